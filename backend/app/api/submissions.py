@@ -4,39 +4,61 @@ Submission-related API endpoints
 
 import json
 import asyncio
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
+import logging
+from datetime import datetime, timedelta
+import orjson
+from cachetools import TTLCache
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, status, File, UploadFile, Form
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, desc
+from sqlalchemy import select, insert, update, delete, exists, literal, lambda_stmt, tuple_, func, and_, desc, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from typing import List, Optional
 
-from app.database import get_db
+from app.database import get_db, AsyncSessionLocal
 from app.models import (
-    User, Task, Submission, SubmissionStatus, 
+    User, Task, Submission, SubmissionStatus, TaskStatus,
     Grade, UserRole, CheckinType
 )
 from app.schemas import (
     ResponseBase, SubmissionCreate, SubmissionGrade, 
-    SubmissionInfo, FileUploadResponse
+    SubmissionInfo, SubmissionRow, FileUploadResponse
 )
 from app.auth import get_current_user, get_current_teacher, get_current_premium_user
-from app.utils.storage_new import StorageError, enhanced_storage
+from app.utils.storage_new import StorageError, FileTooLargeError, enhanced_storage, spool_upload
 from app.utils.file_decoder import file_decoder
+from app.utils.task_cache import get_task_titles, task_exists
+from app.utils.task_list_cache import invalidate_user_task_lists
+from app.utils.pagination import decode_cursor, page_with_cursor
+from app.utils import batch_uploads
+from app.utils.redis_client import get_redis
 from app.config import settings
-from app.services.async_learning_data import trigger_checkin_async, trigger_submission_score_async, trigger_grading_score_async
+from app.services.async_learning_data import (
+    trigger_checkin_async, trigger_submission_score_async, trigger_grading_score_async,
+    run_in_background_session
+)
 from app.utils.notification import notification_service
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/submissions")
 
+# 上传校验用到的常量，模块加载时算好，不在每个请求里重复计算
+_ALLOWED_IMAGE_TYPES = frozenset(settings.ALLOWED_IMAGE_TYPES)
+_MAX_UPLOAD_MB = settings.MAX_UPLOAD_SIZE // (1024 * 1024)
+_FILE_TOO_LARGE_MSG = f"文件太大，最大允许 {_MAX_UPLOAD_MB}MB"
+
 # Test endpoint to manually trigger auto-merge
 @router.post("/test-merge/{task_id}")
 async def test_auto_merge(
     task_id: int,
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
 ):
     """Test endpoint to manually trigger auto-merge for debugging"""
-    await auto_merge_recent_uploads(task_id, current_user.id, db)
+    # 合并在响应返回后执行，不占用请求的 session
+    background_tasks.add_task(run_auto_merge_in_background, task_id, current_user.id)
     return {"code": 0, "msg": "Auto-merge attempted", "data": None}
 
 # Supported file types with their max sizes (in bytes)
@@ -57,6 +79,145 @@ SUPPORTED_FILE_TYPES = {
 }
 
 
+# 每个学生每个任务最多提交次数
+_MAX_SUBMISSIONS = 3
+
+
+# 提交次数相关的数据库约束：submit_count 唯一索引和次数上限 CHECK
+_SUBMIT_COUNT_CONSTRAINTS = ("uq_sub_task_student_count", "ck_sub_submit_count_cap")
+# SQLite 的唯一约束报错只列出字段，不带索引名
+_SUBMIT_COUNT_UNIQUE_COLUMNS = "submissions.task_id, submissions.student_id, submissions.submit_count"
+
+
+def _is_submit_count_conflict(exc: IntegrityError) -> bool:
+    """IntegrityError 是否由提交次数约束引起（其它约束失败不应当作次数已满处理）"""
+    message = str(exc.orig)
+    return (
+        any(name in message for name in _SUBMIT_COUNT_CONSTRAINTS)
+        or _SUBMIT_COUNT_UNIQUE_COLUMNS in message
+    )
+
+
+async def _count_submissions(db: AsyncSession, task_id: int, student_id: int) -> int:
+    """
+    学生在某任务下已有的提交记录数，最多数到 _MAX_SUBMISSIONS 为止
+    （子查询 LIMIT，走 (student_id, task_id) 索引，已满额时不再继续计数）
+    只用于写文件前的预检查，真正的上限判断在 _insert_submission 里。
+    """
+    capped = (
+        select(Submission.id)
+        .where(Submission.task_id == task_id, Submission.student_id == student_id)
+        .limit(_MAX_SUBMISSIONS)
+        .subquery()
+    )
+    result = await db.execute(select(func.count()).select_from(capped))
+    return result.scalar_one()
+
+
+async def _insert_submission(db: AsyncSession, task_id: int, student_id: int,
+                             images: list, text: Optional[str]):
+    """
+    新建一条提交记录（文件上传类接口，每次提交一行）。
+    submit_count 在同一条 INSERT ... SELECT 里按已有最大值 + 1 计算，已满 _MAX_SUBMISSIONS 次时
+    SELECT 不返回行、不插入。两个并发请求算出同一个 submit_count 时，
+    (task_id, student_id, submit_count) 唯一索引让后提交的一方失败，重新计算后再插入。
+    
+    Returns:
+        (id, submit_count, created_at)；已达提交上限时返回 None
+    """
+    now = datetime.utcnow()
+    used = func.coalesce(func.max(Submission.submit_count), 0)
+    insert_stmt = (
+        insert(Submission)
+        .from_select(
+            ["task_id", "student_id", "images", "text", "submit_count", "status", "created_at", "updated_at"],
+            select(
+                literal(task_id),
+                literal(student_id),
+                literal(images, Submission.images.type),
+                literal(text, Submission.text.type),
+                used + 1,
+                literal(SubmissionStatus.SUBMITTED, Submission.status.type),
+                literal(now, Submission.created_at.type),
+                literal(now, Submission.updated_at.type)
+            )
+            .where(Submission.task_id == task_id, Submission.student_id == student_id)
+            .having(used < _MAX_SUBMISSIONS)
+        )
+        .returning(Submission.id, Submission.submit_count, Submission.created_at)
+    )
+    # 每次冲突都意味着另一个请求占用了一个次数，最多重试 _MAX_SUBMISSIONS 次
+    for _ in range(_MAX_SUBMISSIONS):
+        try:
+            row = (await db.execute(insert_stmt)).one_or_none()
+            await db.commit()
+        except IntegrityError as e:
+            await db.rollback()
+            if not _is_submit_count_conflict(e):
+                logger.error("创建提交记录失败: %s", e)
+                raise
+            logger.debug("submit_count 并发冲突，重新计算: %s", e)
+            continue
+        if row is not None:
+            await invalidate_user_task_lists(student_id)
+        return row
+    return None
+
+
+async def _delete_uploaded_files(urls: List[str]) -> None:
+    """提交记录没能创建时，删除本次已经写入存储的文件"""
+    for url in urls:
+        await enhanced_storage.delete_file(url)
+
+
+def _close_files_data(files_data: List[dict]) -> None:
+    """关闭暂存上传内容的临时文件"""
+    for file_data in files_data:
+        content = file_data.get('content')
+        if hasattr(content, 'close'):
+            content.close()
+
+
+async def _ingest_upload(file: UploadFile, too_large_detail: str) -> dict:
+    """校验单个上传文件的类型，并分块暂存（超限立即中止，不把整个文件读成 bytes）"""
+    # 一次字典查找同时完成类型校验和取大小上限
+    max_size = SUPPORTED_FILE_TYPES.get(file.content_type)
+    if max_size is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的文件类型: {file.content_type}"
+        )
+    
+    try:
+        spool, size = await spool_upload(file, max_size)
+    except FileTooLargeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=too_large_detail.format(filename=file.filename)
+        )
+    
+    return {
+        'content': spool,
+        'size': size,
+        'filename': file.filename,
+        'content_type': file.content_type
+    }
+
+
+async def _ingest_uploads(files: List[UploadFile], too_large_detail: str) -> List[dict]:
+    """并发处理一次请求中的所有文件；任一文件失败时关闭已暂存的其它文件并抛出第一个错误"""
+    results = await asyncio.gather(
+        *(_ingest_upload(file, too_large_detail) for file in files),
+        return_exceptions=True
+    )
+    files_data = [result for result in results if not isinstance(result, BaseException)]
+    for result in results:
+        if isinstance(result, BaseException):
+            _close_files_data(files_data)
+            raise result
+    return files_data
+
+
 @router.post("/upload-image", response_model=ResponseBase)
 async def upload_image(
     file: UploadFile = File(...),
@@ -68,84 +229,59 @@ async def upload_image(
     """
     Upload a single image file
     """
-    print(f"[DEBUG] Upload request received - filename: {file.filename}, content_type: {file.content_type}")
-    print(f"[DEBUG] Current user: {current_user.id if current_user else 'None'}")
-    print(f"[DEBUG] Allowed types: {settings.ALLOWED_IMAGE_TYPES}")
+    logger.debug("Upload request received - filename: %s, content_type: %s", file.filename, file.content_type)
+    logger.debug("Current user: %s", current_user.id if current_user else None)
     
     # Validate file type
-    if file.content_type not in settings.ALLOWED_IMAGE_TYPES:
-        print(f"[ERROR] Invalid content type: {file.content_type}")
+    if file.content_type not in _ALLOWED_IMAGE_TYPES:
+        logger.warning("Invalid content type: %s", file.content_type)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"不支持的文件类型: {file.content_type}"
         )
     
-    # Validate file size
-    contents = await file.read()
-    print(f"[DEBUG] File size: {len(contents)} bytes, max allowed: {settings.MAX_UPLOAD_SIZE} bytes")
-    
-    if len(contents) > settings.MAX_UPLOAD_SIZE:
-        print(f"[ERROR] File too large: {len(contents)} > {settings.MAX_UPLOAD_SIZE}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"文件太大，最大允许 {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB"
-        )
-    
     try:
-        # Upload to enhanced_storage
-        url = await enhanced_storage.upload_image(
-            contents, 
+        # 分块写入存储，边写边统计大小，超限立即中止
+        url, file_size = await enhanced_storage.upload_image_stream(
+            file,
             file.filename,
-            file.content_type
+            max_size=settings.MAX_UPLOAD_SIZE
         )
+        logger.debug("File size: %s bytes, max allowed: %s bytes", file_size, settings.MAX_UPLOAD_SIZE)
         
         # If task_id is provided, create a submission record
         if task_id:
-            print(f"🚀 [DEBUG] Creating submission for task {task_id}")
+            logger.debug("Creating submission for task %s", task_id)
             
             # Validate task exists
-            task_result = await db.execute(select(Task).where(Task.id == task_id))
-            task = task_result.scalar_one_or_none()
-            
-            if task:
-                # Check submission count limit
-                existing_submissions = await db.execute(
-                    select(Submission).where(
-                        and_(Submission.task_id == task_id, Submission.student_id == current_user.id)
-                    )
+            if await task_exists(db, task_id):
+                # Create submission record（次数上限在插入语句里判断）
+                created = await _insert_submission(
+                    db, task_id, current_user.id, [url],
+                    text_content.strip() if text_content.strip() else None
                 )
-                current_count = len(existing_submissions.scalars().all())
-                print(f"📊 [DEBUG] Current submission count: {current_count}/3")
                 
-                if current_count < 3:
-                    # Create submission record
-                    submission = Submission(
-                        task_id=task_id,
-                        student_id=current_user.id,
-                        images=[url],
-                        text=text_content.strip() if text_content.strip() else None,
-                        submit_count=current_count + 1,
-                        status=SubmissionStatus.SUBMITTED
-                    )
-                    
-                    db.add(submission)
-                    await db.commit()
-                    await db.refresh(submission)
-                    
-                    print(f"🔍 [DEBUG] Submission created with ID: {submission.id}")
+                if created:
+                    logger.debug("Submission created with ID: %s", created.id)
                     
                     # Auto-merge logic: temporarily disabled for debugging
-                    # await auto_merge_recent_uploads(task_id, current_user.id, db)
+                    # background_tasks.add_task(schedule_auto_merge, task_id, current_user.id)
                 else:
-                    print(f"❌ [DEBUG] Submission limit reached!")
+                    logger.debug("Submission limit reached")
         
         return ResponseBase(
             data=FileUploadResponse(
                 url=url,
                 filename=file.filename,
-                size=len(contents)
+                size=file_size
             ).dict()
         )
+    except FileTooLargeError:
+        logger.debug("File too large: > %s", settings.MAX_UPLOAD_SIZE)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=_FILE_TOO_LARGE_MSG
+        )
     except StorageError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -169,13 +305,10 @@ async def upload_multiple_files(
     Upload multiple files (images, documents, text) for a submission
     支持图片、文件、文字上传，统一10MB限制
     """
-    print(f"🚀 [DEBUG] Upload started - task_id: {task_id}, files: {len(files)}, text: '{text_content}', batch: {is_batch_upload}")
+    logger.debug("Upload started - task_id: %s, files: %s, text: %r, batch: %s", task_id, len(files), text_content, is_batch_upload)
     
     # Validate task exists
-    task_result = await db.execute(select(Task).where(Task.id == task_id))
-    task = task_result.scalar_one_or_none()
-    
-    if not task:
+    if not await task_exists(db, task_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="任务不存在"
@@ -190,48 +323,15 @@ async def upload_multiple_files(
     
     # Auto-merge will be called AFTER submission creation
     
-    # Check submission count limit using database
-    existing_submissions = await db.execute(
-        select(Submission).where(
-            and_(Submission.task_id == task_id, Submission.student_id == current_user.id)
-        )
-    )
-    current_count = len(existing_submissions.scalars().all())
-    print(f"📊 [DEBUG] Current submission count: {current_count}/3")
-    if current_count >= 3:
-        print(f"❌ [DEBUG] Submission limit reached!")
+    # 写文件前先检查提交次数，已满时直接拒绝（最终以插入语句的判断为准）
+    if await _count_submissions(db, task_id, current_user.id) >= _MAX_SUBMISSIONS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="已达到最大提交次数（3次）"
         )
     
-    # Prepare files data for upload
-    files_data = []
-    
-    # Process uploaded files
-    for file in files:
-        # Validate file type
-        if file.content_type not in SUPPORTED_FILE_TYPES:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"不支持的文件类型: {file.content_type}"
-            )
-        
-        # Validate file size
-        contents = await file.read()
-        max_size = SUPPORTED_FILE_TYPES[file.content_type]
-        
-        if len(contents) > max_size:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"文件 {file.filename} 超过大小限制 10MB"
-            )
-        
-        files_data.append({
-            'content': contents,
-            'filename': file.filename,
-            'content_type': file.content_type
-        })
+    # Process uploaded files（各文件并发校验、暂存）
+    files_data = await _ingest_uploads(files, "文件 {filename} 超过大小限制 10MB")
     
     try:
         # Handle file upload or text-only submission
@@ -248,8 +348,6 @@ async def upload_multiple_files(
                 )
             
             file_urls = [file['url'] for file in upload_result['uploaded_files']]
-            # Use database count for consistency (current_count + 1)
-            submission_count = current_count + 1
         else:
             # Text-only submission
             if not text_content.strip():
@@ -258,27 +356,28 @@ async def upload_multiple_files(
                     detail="请至少上传文件或添加文字说明"
                 )
             
-            # Use same count calculation for text-only
-            submission_count = current_count + 1
             file_urls = []
         
-        # Create submission record in database
-        submission = Submission(
-            task_id=task_id,
-            student_id=current_user.id,
-            images=file_urls,  # Store file URLs (empty list if text-only)
-            text=text_content.strip() if text_content.strip() else None,  # Store text description
-            submit_count=submission_count,
-            status=SubmissionStatus.SUBMITTED
+        # Create submission record in database（次数上限在插入语句里判断）
+        submission = await _insert_submission(
+            db, task_id, current_user.id,
+            file_urls,  # Store file URLs (empty list if text-only)
+            text_content.strip() if text_content.strip() else None  # Store text description
         )
         
-        db.add(submission)
-        await db.commit()
-        await db.refresh(submission)
+        if submission is None:
+            logger.debug("Submission limit reached")
+            await _delete_uploaded_files(file_urls)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="已达到最大提交次数（3次）"
+            )
+        
+        submission_count = submission.submit_count
         
         # Auto-merge logic: temporarily disabled for debugging
-        # await auto_merge_recent_uploads(task_id, current_user.id, db)
-        print(f"🔍 [DEBUG] Submission created with ID: {submission.id}")
+        # background_tasks.add_task(schedule_auto_merge, task_id, current_user.id)
+        logger.debug("Submission created with ID: %s", submission.id)
         
         return ResponseBase(
             data={
@@ -298,6 +397,8 @@ async def upload_multiple_files(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+    finally:
+        _close_files_data(files_data)
 
 
 @router.get("/submission-count/{task_id}", response_model=ResponseBase)
@@ -328,104 +429,155 @@ async def get_submission_count(
         )
 
 
+async def _upsert_submission(
+    db: AsyncSession,
+    submission_data: SubmissionCreate,
+    student_id: int
+):
+    """
+    首次提交直接插入，重新提交则更新最近一条记录，不再先查后写。
+    每一步都是带条件的单条语句（INSERT ... WHERE NOT EXISTS / UPDATE ... WHERE submit_count < 上限）。
+    并发的两次首提都可能看不到已有记录，后插入的一方会被 (task_id, student_id, submit_count)
+    唯一索引拒绝，随后按重新提交处理；UPDATE 对同一行串行执行，次数上限在 WHERE 里原子判断。
+    任务必须存在且进行中，这个检查也放在同一条语句的 WHERE 里，不单独查任务。
+    
+    同一学生同一任务可能有多条记录（文件上传每次新建一行），(task_id, student_id) 上没有唯一约束，
+    不能直接用 ON CONFLICT。
+    
+    Returns:
+        (submission_id, is_first_submission)；任务不存在/已结束或已达提交上限时 submission_id 为 None
+    """
+    now = datetime.utcnow()
+    same_student_task = and_(
+        Submission.task_id == submission_data.task_id,
+        Submission.student_id == student_id
+    )
+    task_is_ongoing = exists().where(
+        Task.id == submission_data.task_id,
+        Task.status == TaskStatus.ONGOING
+    )
+    
+    # 1. 首次提交：没有任何记录时插入
+    insert_stmt = (
+        insert(Submission)
+        .from_select(
+            ["task_id", "student_id", "images", "text", "submit_count", "status", "created_at", "updated_at"],
+            select(
+                literal(submission_data.task_id),
+                literal(student_id),
+                literal(submission_data.images, Submission.images.type),
+                literal(submission_data.text, Submission.text.type),
+                literal(1),
+                literal(SubmissionStatus.SUBMITTED, Submission.status.type),
+                literal(now, Submission.created_at.type),
+                literal(now, Submission.updated_at.type)
+            ).where(task_is_ongoing, ~exists().where(same_student_task))
+        )
+        .returning(Submission.id)
+    )
+    try:
+        submission_id = (await db.execute(insert_stmt)).scalar_one_or_none()
+    except IntegrityError as e:
+        await db.rollback()
+        if not _is_submit_count_conflict(e):
+            logger.error("创建提交记录失败: %s", e)
+            raise
+        # 并发的另一次首提已经插入，本次按重新提交处理
+        submission_id = None
+    if submission_id is not None:
+        await db.commit()
+        await invalidate_user_task_lists(student_id)
+        return submission_id, True
+    
+    # 2. 重新提交：更新最近一条记录，次数上限放在 WHERE 里原子判断
+    latest_id = (
+        select(Submission.id)
+        .where(same_student_task)
+        .order_by(desc(Submission.created_at), desc(Submission.id))
+        .limit(1)
+        .scalar_subquery()
+    )
+    update_stmt = (
+        update(Submission)
+        .where(Submission.id == latest_id, Submission.submit_count < _MAX_SUBMISSIONS, task_is_ongoing)
+        .values(
+            images=submission_data.images,
+            text=submission_data.text,
+            submit_count=Submission.submit_count + 1,
+            status=SubmissionStatus.SUBMITTED,
+            grade=None,  # Reset grade
+            comment=None,
+            score=None,
+            graded_by=None,
+            graded_at=None
+        )
+        .returning(Submission.id)
+        .execution_options(synchronize_session=False)
+    )
+    submission_id = (await db.execute(update_stmt)).scalar_one_or_none()
+    await db.commit()
+    if submission_id is not None:
+        await invalidate_user_task_lists(student_id)
+    return submission_id, False
+
+
 @router.post("/submit", response_model=ResponseBase)
 async def submit_homework(
     submission_data: SubmissionCreate,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Submit homework for a task
     """
-    # Check if task exists
-    task_result = await db.execute(select(Task).where(Task.id == submission_data.task_id))
-    task = task_result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="任务不存在"
-        )
-    
-    # Check if task is still ongoing
-    if task.status != "ongoing":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="任务已结束，无法提交"
-        )
-    
-    # Check existing submission
-    existing_result = await db.execute(
-        select(Submission).where(
-            and_(
-                Submission.task_id == submission_data.task_id,
-                Submission.student_id == current_user.id
-            )
-        )
+    submission_id, is_first_submission = await _upsert_submission(
+        db, submission_data, current_user.id
     )
-    existing = existing_result.scalar_one_or_none()
     
-    if existing:
-        # Check submission count
-        if existing.submit_count >= 3:
+    if submission_id is None:
+        # 没有写入，再查一次任务状态区分失败原因（只在失败路径上多一次查询）
+        task_status = (await db.execute(
+            select(Task.status).where(Task.id == submission_data.task_id)
+        )).scalar_one_or_none()
+        
+        if task_status is None:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="已达到最大提交次数（3次）"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="任务不存在"
             )
         
-        # Update existing submission
-        existing.images = submission_data.images
-        existing.text = submission_data.text
-        existing.submit_count += 1
-        existing.status = SubmissionStatus.SUBMITTED
-        existing.grade = None  # Reset grade
-        existing.comment = None
-        existing.score = None
-        existing.graded_by = None
-        existing.graded_at = None
+        if task_status != TaskStatus.ONGOING:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="任务已结束，无法提交"
+            )
         
-        await db.commit()
-        submission_id = existing.id
-        is_first_submission = False  # 这是重新提交
-    else:
-        # Create new submission
-        new_submission = Submission(
-            task_id=submission_data.task_id,
-            student_id=current_user.id,
-            images=submission_data.images,
-            text=submission_data.text,
-            submit_count=1,
-            status=SubmissionStatus.SUBMITTED
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="已达到最大提交次数（3次）"
         )
-        
-        db.add(new_submission)
-        await db.commit()
-        await db.refresh(new_submission)  # 获取生成的ID
-        submission_id = new_submission.id
-        is_first_submission = True  # 这是首次提交
     
-    # V1.0 学习数据统计：触发打卡和积分记录
-    try:
-        # 1. 记录作业提交打卡
-        await trigger_checkin_async(
-            user_id=current_user.id,
-            checkin_type=CheckinType.SUBMISSION,
-            db=db,
-            related_task_id=submission_data.task_id,
-            related_submission_id=submission_id
-        )
-        
-        # 2. 记录提交积分
-        await trigger_submission_score_async(
-            user_id=current_user.id,
-            submission_id=submission_id,
-            task_id=submission_data.task_id,
-            db=db,
-            is_first_submission=is_first_submission
-        )
-    except Exception as e:
-        # 学习数据记录失败不应影响主业务流程
-        print(f"学习数据记录失败: {e}")
+    # V1.0 学习数据统计：响应返回后再记录打卡和积分（按添加顺序依次执行）
+    # 1. 记录作业提交打卡
+    background_tasks.add_task(
+        run_in_background_session,
+        trigger_checkin_async,
+        user_id=current_user.id,
+        checkin_type=CheckinType.SUBMISSION,
+        related_task_id=submission_data.task_id,
+        related_submission_id=submission_id
+    )
+    
+    # 2. 记录提交积分
+    background_tasks.add_task(
+        run_in_background_session,
+        trigger_submission_score_async,
+        user_id=current_user.id,
+        submission_id=submission_id,
+        task_id=submission_data.task_id,
+        is_first_submission=is_first_submission
+    )
     
     return ResponseBase(
         data={"submission_id": submission_id},
@@ -433,99 +585,209 @@ async def submit_homework(
     )
 
 
+def _list_response(items: list, msg: str = "ok", **extra) -> ORJSONResponse:
+    """
+    列表接口直接用 orjson 序列化（datetime/枚举原生支持），
+    跳过 response_model 校验和 jsonable_encoder 的逐字段遍历；响应结构仍是 {code, msg, data}，
+    分页游标等附加字段放在顶层（data 保持为列表，兼容现有客户端）
+    """
+    return ORJSONResponse({"code": 0, "msg": msg, "data": items, **extra})
+
+
+_NDJSON_MEDIA_TYPE = "application/x-ndjson"
+_NDJSON_YIELD_PER = 200
+
+
+def _wants_ndjson(request: Request) -> bool:
+    """客户端通过 Accept: application/x-ndjson 选择逐行流式返回"""
+    return _NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _ndjson_response(db: AsyncSession, query) -> StreamingResponse:
+    """
+    按行流式返回查询结果，每行一个 SubmissionRow 的 JSON；
+    服务端游标分批取数，首行不必等整个结果集查完，内存占用与总行数无关
+    """
+    async def lines():
+        result = await db.stream(query.execution_options(yield_per=_NDJSON_YIELD_PER))
+        async for row in result:
+            yield orjson.dumps(SubmissionRow(**row._mapping)) + b"\n"
+    
+    return StreamingResponse(lines(), media_type=_NDJSON_MEDIA_TYPE)
+
+
+# 列表接口只查 SubmissionRow 用到的列，不加载 photo_paths 等字段，也不构造 ORM 对象
+_SUBMISSION_INFO_COLUMNS = (
+    Submission.id,
+    Submission.task_id,
+    Submission.student_id,
+    Submission.images,
+    Submission.text,
+    Submission.submit_count,
+    Submission.status,
+    Submission.score,
+    Submission.grade,
+    Submission.comment,
+    Submission.graded_by,
+    Submission.graded_at,
+    Submission.created_at,
+)
+
+
 @router.get("/my-submissions", response_model=ResponseBase)
 async def get_my_submissions(
     task_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Get current user's submissions
+    
+    按 (created_at, id) 倒序做游标分页：下一页把响应里的 next_cursor 作为 cursor 传回
     """
-    query = select(Submission).where(Submission.student_id == current_user.id)
+    query = select(*_SUBMISSION_INFO_COLUMNS).where(Submission.student_id == current_user.id)
     
     if task_id:
         query = query.where(Submission.task_id == task_id)
     
-    query = query.order_by(desc(Submission.created_at))
+    if cursor:
+        query = query.where(tuple_(Submission.created_at, Submission.id) < decode_cursor(cursor))
+    
+    query = (
+        query.order_by(desc(Submission.created_at), desc(Submission.id))
+        .limit(limit + 1)
+        .offset(offset)
+    )
     
     result = await db.execute(query)
-    submissions = result.scalars().all()
+    rows, next_cursor = page_with_cursor(result.all(), limit)
+    
+    # 任务标题走缓存，未命中的一次性批量查询
+    task_titles = await get_task_titles(db, (row.task_id for row in rows))
     
     # Convert to response format
-    submission_list = []
-    for sub in submissions:
-        sub_info = SubmissionInfo.from_orm(sub)
-        sub_info.images = sub.images if sub.images else []
-        
-        # Get task title
-        task_result = await db.execute(select(Task).where(Task.id == sub.task_id))
-        task = task_result.scalar_one_or_none()
-        if task:
-            sub_info.task_title = task.title
-        
-        submission_list.append(sub_info.dict())
+    submission_list = [
+        SubmissionRow(
+            **row._mapping,
+            student_nickname=None,
+            student_avatar=None,
+            task_title=task_titles.get(row.task_id)
+        )
+        for row in rows
+    ]
     
-    return ResponseBase(data=submission_list)
+    return _list_response(submission_list, next_cursor=next_cursor)
 
 
-@router.get("/{submission_id}", response_model=ResponseBase)
-async def get_submission(
-    submission_id: int,
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
-):
+async def _apply_grade(db: AsyncSession, grade_data: SubmissionGrade, teacher_id: int):
     """
-    Get submission details
+    写入批改结果：一条 UPDATE ... RETURNING，同时带回后续统计和通知需要的学生、任务信息
+    
+    Returns:
+        (student_id, task_id, openid, task_title, graded_at)；提交不存在时返回 None
     """
+    graded_at = datetime.utcnow()
     result = await db.execute(
-        select(Submission).where(Submission.id == submission_id)
+        update(Submission)
+        .where(Submission.id == grade_data.submission_id)
+        .values(
+            score=grade_data.score,
+            grade=Grade(grade_data.grade),
+            comment=grade_data.feedback,
+            status=SubmissionStatus.GRADED,
+            graded_by=teacher_id,
+            graded_at=graded_at
+        )
+        .returning(
+            Submission.student_id,
+            Submission.task_id,
+            select(User.openid).where(User.id == Submission.student_id).scalar_subquery(),
+            select(Task.title).where(Task.id == Submission.task_id).scalar_subquery()
+        )
+        .execution_options(synchronize_session=False)
     )
-    submission = result.scalar_one_or_none()
+    row = result.one_or_none()
+    if row is None:
+        return None
     
-    if not submission:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="提交记录不存在"
+    await db.commit()
+    student_id, task_id, openid, task_title = row
+    await invalidate_user_task_lists(student_id)
+    return student_id, task_id, openid, task_title, graded_at
+
+
+@router.get("/pending-grading", response_model=ResponseBase)
+async def get_pending_submissions(
+    request: Request,
+    task_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_teacher),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get submissions pending grading (teacher only)
+    
+    按 (created_at, id) 正序做游标分页：下一页把响应里的 next_cursor 作为 cursor 传回。
+    请求头带 Accept: application/x-ndjson 时不分页，从 cursor 之后逐行流式返回全部待批改提交。
+    """
+    # 学生昵称/头像直接 JOIN 出来，避免逐条查询（N+1）
+    query = (
+        select(
+            *_SUBMISSION_INFO_COLUMNS,
+            User.nickname.label("student_nickname"),
+            User.avatar.label("student_avatar")
         )
+        .join(User, User.id == Submission.student_id)
+        .where(Submission.status == SubmissionStatus.SUBMITTED)
+    )
     
-    # Check permission (student can only see own, teacher can see all)
-    if current_user.role == UserRole.STUDENT and submission.student_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="无权查看此提交"
+    if task_id:
+        query = query.where(Submission.task_id == task_id)
+    
+    if cursor:
+        query = query.where(tuple_(Submission.created_at, Submission.id) > decode_cursor(cursor))
+    
+    query = query.order_by(Submission.created_at, Submission.id)
+    
+    if _wants_ndjson(request):
+        # 流式返回时任务标题一并 JOIN 出来，不再按页批量查缓存
+        return _ndjson_response(
+            db,
+            query.join(Task, Task.id == Submission.task_id).add_columns(Task.title.label("task_title"))
         )
     
-    sub_info = SubmissionInfo.from_orm(submission)
-    sub_info.images = submission.images if submission.images else []
+    result = await db.execute(query.limit(limit + 1))
+    rows, next_cursor = page_with_cursor(result.all(), limit)
     
-    # Get related info
-    student_result = await db.execute(select(User).where(User.id == submission.student_id))
-    student = student_result.scalar_one_or_none()
-    if student:
-        sub_info.student_nickname = student.nickname
-        sub_info.student_avatar = student.avatar
+    # 任务标题走缓存，未命中的一次性批量查询
+    task_titles = await get_task_titles(db, (row.task_id for row in rows))
     
-    task_result = await db.execute(select(Task).where(Task.id == submission.task_id))
-    task = task_result.scalar_one_or_none()
-    if task:
-        sub_info.task_title = task.title
+    # Convert to response format
+    submission_list = [
+        SubmissionRow(**row._mapping, task_title=task_titles.get(row.task_id))
+        for row in rows
+    ]
     
-    return ResponseBase(data=sub_info.dict())
-
+    return _list_response(submission_list, next_cursor=next_cursor)
 
-@router.post("/grade", response_model=ResponseBase)
-async def grade_submission(
-    grade_data: SubmissionGrade,
-    current_user: User = Depends(get_current_teacher),
+# 动态路径 /{submission_id} 必须放在 /pending-grading 等固定路径之后注册，否则会抢先匹配
+@router.get("/{submission_id}", response_model=ResponseBase)
+async def get_submission(
+    submission_id: int,
+    current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Grade a submission (teacher only)
+    Get submission details
     """
-    # Get submission
     result = await db.execute(
-        select(Submission).where(Submission.id == grade_data.submission_id)
+        select(Submission)
+        .options(joinedload(Submission.task), joinedload(Submission.student))
+        .where(Submission.id == submission_id)
     )
     submission = result.scalar_one_or_none()
     
@@ -535,103 +797,27 @@ async def grade_submission(
             detail="提交记录不存在"
         )
     
-    # Update grading info
-    submission.score = grade_data.score
-    submission.grade = Grade(grade_data.grade)
-    submission.comment = grade_data.feedback
-    submission.graded_by = current_user.id
-    submission.graded_at = datetime.utcnow()
-    submission.status = SubmissionStatus.GRADED
-    
-    await db.commit()
-    
-    # V1.0 学习数据统计：触发质量积分更新
-    try:
-        await trigger_grading_score_async(
-            user_id=submission.student_id,
-            submission_id=submission.id,
-            task_id=submission.task_id,
-            grade=submission.grade,
-            db=db
-        )
-    except Exception as e:
-        # 学习数据记录失败不应影响主业务流程
-        print(f"批改积分记录失败: {e}")
-    
-    # V1.0 微信通知：发送批改完成通知
-    try:
-        # 获取学生信息
-        student_result = await db.execute(
-            select(User).where(User.id == submission.student_id)
-        )
-        student = student_result.scalar_one_or_none()
-        
-        # 获取任务信息
-        task_result = await db.execute(
-            select(Task).where(Task.id == submission.task_id)
+    # Check permission (student can only see own, teacher can see all)
+    if current_user.role == UserRole.STUDENT and submission.student_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权查看此提交"
         )
-        task = task_result.scalar_one_or_none()
-        
-        if student and task:
-            # await notification_service.send_grade_notification(
-            #     openid=student.openid,
-            #     task_title=task.title,
-            #     grade=submission.grade.value,
-            #     comment=submission.feedback,
-            #     user_id=student.id
-            # )
-            pass
-    except Exception as e:
-        # 通知发送失败不应影响主业务流程
-        print(f"批改完成通知发送失败: {e}")
     
-    return ResponseBase(msg="批改完成")
-
-
-@router.get("/pending-grading", response_model=ResponseBase)
-async def get_pending_submissions(
-    task_id: Optional[int] = None,
-    current_user: User = Depends(get_current_teacher),
-    db: AsyncSession = Depends(get_db)
-):
-    """
-    Get submissions pending grading (teacher only)
-    """
-    query = select(Submission).where(Submission.status == SubmissionStatus.SUBMITTED)
+    sub_info = SubmissionInfo.model_validate(submission)
     
-    if task_id:
-        query = query.where(Submission.task_id == task_id)
-    
-    query = query.order_by(Submission.created_at)
+    # Get related info
+    if submission.student:
+        sub_info.student_nickname = submission.student.nickname
+        sub_info.student_avatar = submission.student.avatar
     
-    result = await db.execute(query)
-    submissions = result.scalars().all()
+    if submission.task:
+        sub_info.task_title = submission.task.title
     
-    # Convert to response format
-    submission_list = []
-    for sub in submissions:
-        sub_info = SubmissionInfo.from_orm(sub)
-        sub_info.images = sub.images if sub.images else []
-        
-        # Get student info
-        student_result = await db.execute(select(User).where(User.id == sub.student_id))
-        student = student_result.scalar_one_or_none()
-        if student:
-            sub_info.student_nickname = student.nickname
-            sub_info.student_avatar = student.avatar
-        
-        # Get task info
-        task_result = await db.execute(select(Task).where(Task.id == sub.task_id))
-        task = task_result.scalar_one_or_none()
-        if task:
-            sub_info.task_title = task.title
-        
-        submission_list.append(sub_info.dict())
-    
-    return ResponseBase(data=submission_list)
+    return ResponseBase(data=sub_info.model_dump())
+
 
 # 增强版批改API，集成微信通知
-from fastapi import BackgroundTasks
 # from app.utils.notification import notification_service
 
 @router.post("/grade-enhanced", response_model=ResponseBase)
@@ -644,84 +830,68 @@ async def grade_submission_enhanced(
     """
     Enhanced submission grading with WeChat notification
     """
-    # Get submission
-    result = await db.execute(
-        select(Submission).where(Submission.id == grade_data.submission_id)
-    )
-    submission = result.scalar_one_or_none()
+    # 一条 UPDATE ... RETURNING 写入批改结果并取回学生、任务信息
+    graded = await _apply_grade(db, grade_data, current_user.id)
     
-    if not submission:
+    if not graded:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="提交记录不存在"
         )
     
-    # Get task and student info
-    task_result = await db.execute(select(Task).where(Task.id == submission.task_id))
-    task = task_result.scalar_one_or_none()
-    
-    student_result = await db.execute(select(User).where(User.id == submission.student_id))
-    student = student_result.scalar_one_or_none()
-    
-    if not task or not student:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="相关任务或学生信息不存在"
-        )
-    
-    # Update submission
-    submission.score = grade_data.score
-    submission.grade = Grade(grade_data.grade)
-    submission.comment = grade_data.feedback
-    submission.status = SubmissionStatus.GRADED
-    submission.graded_by = current_user.id
-    submission.graded_at = datetime.utcnow()
+    student_id, task_id, openid, task_title, graded_at = graded
+    grade = Grade(grade_data.grade)
     
-    await db.commit()
-    await db.refresh(submission)
+    # V1.0 学习数据统计：响应返回后再更新质量积分
+    background_tasks.add_task(
+        run_in_background_session,
+        trigger_grading_score_async,
+        user_id=student_id,
+        submission_id=grade_data.submission_id,
+        task_id=task_id,
+        grade=grade
+    )
     
-    # V1.0 学习数据统计：触发质量积分更新
-    try:
-        await trigger_grading_score_async(
-            user_id=submission.student_id,
-            submission_id=submission.id,
-            task_id=submission.task_id,
-            grade=submission.grade,
-            db=db
+    # 微信通知写入 Redis 队列，由独立消费者批量发送（Redis 未启用时不发送）
+    queued = False
+    if openid:
+        queued = await notification_service.enqueue_grade_notification(
+            openid=openid,
+            task_title=task_title,
+            grade=grade.value,
+            score=grade_data.score,
+            comment=grade_data.feedback,
+            user_id=student_id
         )
-    except Exception as e:
-        # 学习数据记录失败不应影响主业务流程
-        print(f"批改积分记录失败: {e}")
-    
-    # 异步发送微信通知
-    # if student.openid:
-    #     background_tasks.add_task(
-    #         notification_service.send_grade_notification,
-    #         openid=student.openid,
-    #         task_title=task.title,
-    #         grade=grade_data.grade,
-    #         user_id=student.id
-    #     )
     
     return ResponseBase(
         data={
-            "submission_id": submission.id,
-            "score": submission.score,
-            "grade": submission.grade.value,
-            "graded_at": submission.graded_at.isoformat(),
-            "notification_sent": bool(student.openid)
+            "submission_id": grade_data.submission_id,
+            "score": grade_data.score,
+            "grade": grade.value,
+            "graded_at": graded_at.isoformat(),
+            "notification_sent": queued
         },
         msg="批改完成"
     )
 
 
-# Simplified batch upload handler
-from typing import Dict
+@router.post("/grade", response_model=ResponseBase)
+async def grade_submission(
+    grade_data: SubmissionGrade,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_teacher),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Grade a submission (teacher only)
+    与 /grade-enhanced 共用同一实现（批改页面调用的是这个路径）
+    """
+    return await grade_submission_enhanced(grade_data, background_tasks, current_user, db)
 
-# Global enhanced_storage for batch uploads  
-batch_enhanced_storage: Dict[str, Dict] = {}
-batch_locks: Dict[str, bool] = {}
 
+# Simplified batch upload handler
+# 批次状态见 app.utils.batch_uploads：启用 Redis 时多 worker 共享，文件内容只落在暂存目录
 async def handle_batch_upload(
     task_id: int, 
     student_id: int, 
@@ -735,71 +905,56 @@ async def handle_batch_upload(
     """
     Simplified batch file upload handler
     """
-    print(f"🔄 [BATCH] Processing - batch_id: {batch_id}, file_index: {file_index}, total: {total_files}")
-    global batch_enhanced_storage
-    
-    # Initialize batch if not exists
-    if batch_id not in batch_enhanced_storage:
-        print(f"🆕 [BATCH] New batch - {batch_id}")
-        batch_enhanced_storage[batch_id] = {
-            'task_id': task_id,
-            'student_id': student_id,
-            'files_data': [],
-            'text_content': text_content,
-            'total_files': total_files,
-            'received_files': 0
-        }
-    
-    batch_info = batch_enhanced_storage[batch_id]
-    
-    # Process files
-    for file in files:
-        # Validate file
-        if file.content_type not in SUPPORTED_FILE_TYPES:
-            raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file.content_type}")
-        
-        contents = await file.read()
-        if len(contents) > SUPPORTED_FILE_TYPES[file.content_type]:
-            raise HTTPException(status_code=400, detail="文件过大")
-        
-        batch_info['files_data'].append({
-            'content': contents,
-            'filename': file.filename,
-            'content_type': file.content_type,
-            'index': file_index
-        })
+    logger.debug("[BATCH] Processing - batch_id: %s, file_index: %s, total: %s", batch_id, file_index, total_files)
     
-    batch_info['received_files'] += 1
-    print(f"📊 [BATCH] Progress - {batch_info['received_files']}/{batch_info['total_files']}")
-    print(f"🔍 [BATCH] 当前收到的文件索引: {[f['index'] for f in batch_info['files_data']]}")
+    # Process files（各文件并发校验、暂存到磁盘）
+    files_data = await _ingest_uploads(files, "文件过大")
+    try:
+        staged_files = await asyncio.gather(*(
+            enhanced_storage.stage_batch_file(batch_id, file_index, file_data)
+            for file_data in files_data
+        ))
+    except StorageError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    finally:
+        _close_files_data(files_data)
+    
+    progress = await batch_uploads.add_batch_files(
+        batch_id, task_id, student_id, text_content, total_files, list(staged_files)
+    )
+    logger.debug("[BATCH] Progress - %s/%s", progress['received_files'], progress['total_files'])
     
     # Check if complete
-    if batch_info['received_files'] >= batch_info['total_files']:
-        print(f"✅ [BATCH] Complete - creating submission")
+    # 计数是原子递增的，只有恰好凑齐的那个请求负责创建提交；同一批次的并发请求不会重复提交
+    if progress['received_files'] == max(progress['total_files'], 1):
+        logger.debug("[BATCH] Complete - creating submission")
         try:
             result = await create_batch_submission(batch_id, db)
             return result
+        except HTTPException:
+            # create_batch_submission 已自行清理批次状态和暂存文件
+            raise
         except Exception as e:
-            import traceback
-            error_detail = traceback.format_exc()
-            print(f"❌ [BATCH] Failed: {e}")
-            print(f"❌ [BATCH] Traceback: {error_detail}")
-            if batch_id in batch_enhanced_storage:
-                del batch_enhanced_storage[batch_id]
+            logger.exception("[BATCH] Failed: %s", e)
+            await batch_uploads.discard_batch(batch_id)
+            await enhanced_storage.discard_staged_batch(batch_id)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"批量上传失败: {str(e)}"
             )
     else:
-        print(f"⏳ [BATCH] Waiting for more files")
+        logger.debug("[BATCH] Waiting for more files")
         return ResponseBase(
             data={
                 'batch_id': batch_id,
-                'received_files': batch_info['received_files'], 
-                'total_files': batch_info['total_files'],
+                'received_files': progress['received_files'], 
+                'total_files': progress['total_files'],
                 'status': 'partial'
             },
-            msg=f"已接收 {batch_info['received_files']}/{batch_info['total_files']} 个文件"
+            msg=f"已接收 {progress['received_files']}/{progress['total_files']} 个文件"
         )
 
 
@@ -818,28 +973,18 @@ async def upload_encoded_files(
     """
     import json
     
-    print(f"🚀 [ENCODED] 接收编码文件上传 - task_id: {task_id}, 文件数: {file_count}, 总大小: {total_size}B")
+    logger.debug("[ENCODED] 接收编码文件上传 - task_id: %s, 文件数: %s, 总大小: %sB", task_id, file_count, total_size)
     
     try:
         # 验证任务存在
-        task_result = await db.execute(select(Task).where(Task.id == task_id))
-        task = task_result.scalar_one_or_none()
-        
-        if not task:
+        if not await task_exists(db, task_id):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="任务不存在"
             )
         
-        # 检查提交次数限制
-        existing_submissions = await db.execute(
-            select(Submission).where(
-                and_(Submission.task_id == task_id, Submission.student_id == current_user.id)
-            )
-        )
-        current_count = len(existing_submissions.scalars().all())
-        
-        if current_count >= 3:
+        # 写文件前先检查提交次数，已满时直接拒绝（最终以插入语句的判断为准）
+        if await _count_submissions(db, task_id, current_user.id) >= _MAX_SUBMISSIONS:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="已达到最大提交次数（3次）"
@@ -848,7 +993,7 @@ async def upload_encoded_files(
         # 解析编码文件数据
         try:
             files_data = json.loads(encoded_files)
-            print(f"📦 [ENCODED] 解析到 {len(files_data)} 个编码文件")
+            logger.debug("[ENCODED] 解析到 %s 个编码文件", len(files_data))
         except json.JSONDecodeError as e:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -876,22 +1021,22 @@ async def upload_encoded_files(
         # 提取文件URLs
         file_urls = [file['url'] for file in decode_result['saved_files']]
         
-        # 创建提交记录
-        submission_count = current_count + 1
-        submission = Submission(
-            task_id=task_id,
-            student_id=current_user.id,
-            images=file_urls,
-            text=text_content.strip() if text_content.strip() else None,
-            submit_count=submission_count,
-            status=SubmissionStatus.SUBMITTED
+        # 创建提交记录（次数上限在插入语句里判断）
+        submission = await _insert_submission(
+            db, task_id, current_user.id, file_urls,
+            text_content.strip() if text_content.strip() else None
         )
         
-        db.add(submission)
-        await db.commit()
-        await db.refresh(submission)
+        if submission is None:
+            await _delete_uploaded_files(file_urls)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="已达到最大提交次数（3次）"
+            )
+        
+        submission_count = submission.submit_count
         
-        print(f"✅ [ENCODED] 编码文件提交成功 - submission_id: {submission.id}")
+        logger.debug("[ENCODED] 编码文件提交成功 - submission_id: %s", submission.id)
         
         return ResponseBase(
             data={
@@ -910,7 +1055,7 @@ async def upload_encoded_files(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ [ENCODED] 编码文件上传失败: {str(e)}")
+        logger.error("[ENCODED] 编码文件上传失败: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"编码文件上传失败: {str(e)}"
@@ -921,19 +1066,25 @@ async def create_batch_submission(batch_id: str, db: AsyncSession) -> ResponseBa
     """
     Create final submission record when all batch files are received
     """
-    global batch_enhanced_storage
+    # 取出后批次状态即被删除，并发的最后两个请求只有一个能继续
+    batch_info = await batch_uploads.pop_batch(batch_id)
     
-    if batch_id not in batch_enhanced_storage:
+    if batch_info is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="批次上传信息不存在"
         )
     
-    batch_info = batch_enhanced_storage[batch_id]
-    
     try:
-        # Upload files to enhanced_storage
-        upload_result = await enhanced_storage.upload_files_to_submission(
+        # 写文件前先检查提交次数，已满时直接拒绝（最终以插入语句的判断为准）
+        if await _count_submissions(db, batch_info['task_id'], batch_info['student_id']) >= _MAX_SUBMISSIONS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="已达到最大提交次数（3次）"
+            )
+        
+        # Move staged files into the submission folder
+        upload_result = await enhanced_storage.commit_staged_files(
             batch_info['files_data'], batch_info['task_id'], batch_info['student_id']
         )
         
@@ -945,34 +1096,20 @@ async def create_batch_submission(batch_id: str, db: AsyncSession) -> ResponseBa
         
         file_urls = [file['url'] for file in upload_result['uploaded_files']]
         
-        # Check current submission count
-        existing_submissions = await db.execute(
-            select(Submission).where(
-                and_(Submission.task_id == batch_info['task_id'], 
-                     Submission.student_id == batch_info['student_id'])
-            )
-        )
-        current_count = len(existing_submissions.scalars().all())
-        submission_count = current_count + 1
-        
-        # Create submission record
-        submission = Submission(
-            task_id=batch_info['task_id'],
-            student_id=batch_info['student_id'],
-            images=file_urls,
-            text=batch_info['text_content'].strip() if batch_info['text_content'].strip() else None,
-            submit_count=submission_count,
-            status=SubmissionStatus.SUBMITTED
+        # Create submission record（次数上限在插入语句里判断）
+        submission = await _insert_submission(
+            db, batch_info['task_id'], batch_info['student_id'], file_urls,
+            batch_info['text_content'].strip() if batch_info['text_content'].strip() else None
         )
         
-        db.add(submission)
-        await db.commit()
-        await db.refresh(submission)
+        if submission is None:
+            await _delete_uploaded_files(file_urls)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="已达到最大提交次数（3次）"
+            )
         
-        # Clean up batch enhanced_storage and lock
-        del batch_enhanced_storage[batch_id]
-        if batch_id in batch_locks:
-            del batch_locks[batch_id]
+        submission_count = submission.submit_count
         
         return ResponseBase(
             data={
@@ -988,28 +1125,92 @@ async def create_batch_submission(batch_id: str, db: AsyncSession) -> ResponseBa
             msg=f"批量上传完成！第 {submission_count} 次提交，共 {len(file_urls)} 个文件"
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
-        # Clean up batch on error
-        if batch_id in batch_enhanced_storage:
-            del batch_enhanced_storage[batch_id]
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"创建提交记录失败: {str(e)}"
         )
+    finally:
+        await enhanced_storage.discard_staged_batch(batch_id)
+
 
+# 自动合并的时间窗口；一批连续上传只由第一个请求调度一次合并，窗口结束后再执行
+AUTO_MERGE_WINDOW_SECONDS = 3
+AUTO_MERGE_DELAY_SECONDS = 3.5
 
-async def auto_merge_recent_uploads(task_id: int, student_id: int, db: AsyncSession):
+# 未启用 Redis 时的进程内防抖标记
+_local_merge_debounce: TTLCache = TTLCache(maxsize=4096, ttl=AUTO_MERGE_WINDOW_SECONDS)
+
+
+async def _acquire_merge_debounce(task_id: int, student_id: int) -> bool:
+    """窗口内第一个请求返回 True，其余返回 False（Redis SET NX PX）"""
+    key = f"merge:{task_id}:{student_id}"
+    redis = get_redis()
+    if redis is not None:
+        try:
+            return bool(await redis.set(key, "1", nx=True, px=AUTO_MERGE_WINDOW_SECONDS * 1000))
+        except Exception as e:
+            logger.warning("[AUTO-MERGE] Redis 防抖失败，退回进程内标记: %s", e)
+    
+    if key in _local_merge_debounce:
+        return False
+    _local_merge_debounce[key] = True
+    return True
+
+
+async def schedule_auto_merge(task_id: int, student_id: int):
+    """
+    防抖后的自动合并：同一批上传只有第一个请求会等窗口结束后执行一次合并，
+    其余请求直接返回。合并在独立的 session 中执行（请求的 session 届时已关闭）
+    """
+    if not await _acquire_merge_debounce(task_id, student_id):
+        return
+    
+    since = datetime.utcnow() - timedelta(seconds=AUTO_MERGE_WINDOW_SECONDS)
+    await asyncio.sleep(AUTO_MERGE_DELAY_SECONDS)
+    await run_auto_merge_in_background(task_id, student_id, since=since)
+
+
+async def run_auto_merge_in_background(task_id: int, student_id: int,
+                                       since: Optional[datetime] = None):
+    """
+    在 BackgroundTasks 中执行自动合并，单独开一个 session。
+    合并失败时 session 关闭即回滚整个事务；合并只是优化，失败只记录日志
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            await auto_merge_recent_uploads(task_id, student_id, db, since=since)
+    except Exception:
+        logger.exception("[AUTO-MERGE] 自动合并失败 (task=%s, student=%s)", task_id, student_id)
+
+
+async def auto_merge_recent_uploads(task_id: int, student_id: int, db: AsyncSession,
+                                    since: Optional[datetime] = None):
     """
     Auto-merge multiple submissions uploaded within 3 seconds into a single submission
     This solves the frontend limitation where each file creates a separate request
+    
+    since: 合并窗口起点，默认为当前时间前 3 秒（延迟执行的合并传入调度时的窗口起点）
+    出错时直接抛出，由调用方的 session 回滚并记录日志
     """
-    try:
-        # Find submissions from the last 3 seconds for this task/student
-        from datetime import timedelta
-        cutoff_time = datetime.utcnow() - timedelta(seconds=3)
-        
-        recent_submissions = await db.execute(
-            select(Submission).where(
+    # Find submissions from the last 3 seconds for this task/student
+    cutoff_time = since or datetime.utcnow() - timedelta(seconds=AUTO_MERGE_WINDOW_SECONDS)
+    
+    # 同一学生同一任务的合并串行执行，避免并发合并重复追加图片或重复删除；
+    # 事务级 advisory lock 在 commit/rollback 时自动释放（仅 PostgreSQL）
+    if db.bind.dialect.name == "postgresql":
+        await db.execute(
+            text("SELECT pg_advisory_xact_lock(:task_id, :student_id)"),
+            {"task_id": task_id, "student_id": student_id}
+        )
+    
+    # 只取合并需要的列，不加载完整的 ORM 对象；
+    # lambda_stmt 按 lambda 缓存语句结构，参数每次重新绑定，省去每次构建查询
+    recent_submissions = await db.execute(
+        lambda_stmt(
+            lambda: select(Submission.id, Submission.images, Submission.text).where(
                 and_(
                     Submission.task_id == task_id,
                     Submission.student_id == student_id,
@@ -1018,44 +1219,42 @@ async def auto_merge_recent_uploads(task_id: int, student_id: int, db: AsyncSess
                 )
             ).order_by(Submission.created_at)
         )
+    )
+    
+    submissions_list = recent_submissions.all()
+    
+    # If we have multiple submissions within 3 seconds, merge them
+    if len(submissions_list) > 1:
+        logger.debug("[AUTO-MERGE] 发现 %s 个近期提交（3秒内），开始自动合并", len(submissions_list))
         
-        submissions_list = recent_submissions.scalars().all()
+        # Keep the first submission, merge others into it
+        main_id = submissions_list[0].id
+        merge_ids = [row.id for row in submissions_list[1:]]
         
-        # If we have multiple submissions within 3 seconds, merge them
-        if len(submissions_list) > 1:
-            print(f"🔄 [AUTO-MERGE] 发现 {len(submissions_list)} 个近期提交（3秒内），开始自动合并...")
-            
-            # Keep the first submission, merge others into it
-            main_submission = submissions_list[0]
-            merge_submissions = submissions_list[1:]
-            
-            # Collect all images and text from all submissions
-            all_images = list(main_submission.images) if main_submission.images else []
-            all_text_parts = []
-            
-            if main_submission.text and main_submission.text.strip():
-                all_text_parts.append(main_submission.text.strip())
-            
-            # Merge data from other submissions
-            for sub in merge_submissions:
-                if sub.images:
-                    all_images.extend(sub.images)
-                if sub.text and sub.text.strip():
-                    all_text_parts.append(sub.text.strip())
-            
-            # Update main submission with merged data
-            main_submission.images = all_images
-            main_submission.text = ' '.join(all_text_parts) if all_text_parts else None
-            
-            # Delete the duplicate submissions
-            for sub in merge_submissions:
-                await db.delete(sub)
-            
-            await db.commit()
-            
-            print(f"✅ [AUTO-MERGE] 成功合并到提交 ID {main_submission.id}，包含 {len(all_images)} 个文件")
-            
-    except Exception as e:
-        print(f"❌ [AUTO-MERGE] 自动合并失败: {e}")
-        # Don't raise the error, just log it - this is a background optimization
-
+        # Collect all images and text from all submissions
+        all_images = []
+        all_text_parts = []
+        for row in submissions_list:
+            if row.images:
+                all_images.extend(row.images)
+            if row.text and row.text.strip():
+                all_text_parts.append(row.text.strip())
+        
+        # Update main submission with merged data
+        await db.execute(
+            update(Submission)
+            .where(Submission.id == main_id)
+            .values(images=all_images, text=' '.join(all_text_parts) if all_text_parts else None)
+            .execution_options(synchronize_session=False)
+        )
+        
+        # Delete the duplicate submissions in one statement
+        await db.execute(
+            delete(Submission).where(Submission.id.in_(merge_ids)),
+            execution_options={"synchronize_session": False}
+        )
+        
+        await db.commit()
+        await invalidate_user_task_lists(student_id)
+        
+        logger.debug("[AUTO-MERGE] 成功合并到提交 ID %s，包含 %s 个文件", main_id, len(all_images))
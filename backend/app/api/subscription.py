@@ -100,15 +100,11 @@ async def upgrade_to_premium_demo(
             detail="Subscription upgrade is only available for students"
         )
     service = AsyncSubscriptionService(db)
-    updated_user = await service.upgrade_to_premium(current_user, days=365)
-    
-    status = await service.check_subscription_status(updated_user)
-    display_text = await service.get_subscription_display_text(updated_user)
+    upgrade_info = await service.upgrade_and_describe(current_user, days=365)
     
     return ResponseBase(
         data={
             "message": "升级成功！",
-            "subscription_status": status,
-            "display_text": display_text
+            **upgrade_info
         }
     )
\ No newline at end of file
@@ -3,10 +3,11 @@
 处理三级标签体系的创建、管理和统计
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Response, status, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, desc, func, or_
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, insert, update, exists, and_, desc, func, or_
+from sqlalchemy.orm import aliased
 from typing import List, Optional
 
 from app.database import get_db
@@ -18,9 +19,26 @@ from app.schemas import (
     TaskTagHierarchyResponse, TaskTagStatsResponse
 )
 from app.auth import get_current_user, get_current_teacher
+from app.utils.tag_cache import (
+    get_cached_tag_hierarchy, set_cached_tag_hierarchy, invalidate_tag_hierarchy
+)
 
 router = APIRouter(prefix="/tags")
 
+# 各级标签要求的父标签级别及校验失败时的提示
+_PARENT_LEVEL_RULES = {
+    TagLevel.SECONDARY: (TagLevel.PRIMARY, "二级标签的父标签必须是一级标签"),
+    TagLevel.TERTIARY: (TagLevel.SECONDARY, "三级标签的父标签必须是二级标签"),
+}
+
+
+def _dump_response(data, msg: str = "ok") -> bytes:
+    """
+    直接用 orjson 序列化 {code, msg, data}（datetime/枚举原生支持），
+    数据库行不再经过 Pydantic 模型和 jsonable_encoder
+    """
+    return orjson.dumps({"code": 0, "msg": msg, "data": data})
+
 
 @router.get("/hierarchy", response_model=ResponseBase[TaskTagHierarchyResponse])
 async def get_tag_hierarchy(
@@ -28,53 +46,59 @@ async def get_tag_hierarchy(
     db: AsyncSession = Depends(get_db)
 ):
     """
-    获取标签层级结构
+    获取标签层级结构（响应体带缓存，标签增删改时清除）
     """
-    # 获取所有一级标签及其子标签
-    result = await db.execute(
-        select(TaskTag)
-        .options(selectinload(TaskTag.children))
+    cached = await get_cached_tag_hierarchy()
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
+    # 用递归 CTE 一次查出所有启用的一级标签及其下启用的二、三级标签
+    tag_tree = (
+        select(TaskTag.id, TaskTag.level)
         .where(
             and_(
                 TaskTag.level == TagLevel.PRIMARY,
                 TaskTag.is_active == True
             )
         )
-        .order_by(TaskTag.sort_order, TaskTag.name)
+        .cte("tag_tree", recursive=True)
+    )
+    child = aliased(TaskTag)
+    tag_tree = tag_tree.union(
+        select(child.id, child.level)
+        .join(tag_tree, child.parent_id == tag_tree.c.id)
+        .where(
+            and_(
+                child.is_active == True,
+                or_(
+                    and_(tag_tree.c.level == TagLevel.PRIMARY, child.level == TagLevel.SECONDARY),
+                    and_(tag_tree.c.level == TagLevel.SECONDARY, child.level == TagLevel.TERTIARY)
+                )
+            )
+        )
     )
-    primary_tags = result.scalars().all()
-    
-    # 格式化响应数据
-    primary_tags_data = []
-    for tag in primary_tags:
-        tag_dict = {
-            **tag.__dict__,
-            "children": []
-        }
-        
-        # 添加二级标签
-        if tag.children:
-            secondary_tags = [child for child in tag.children if child.level == TagLevel.SECONDARY and child.is_active]
-            secondary_tags.sort(key=lambda x: (x.sort_order, x.name))
-            
-            for secondary in secondary_tags:
-                secondary_dict = {
-                    **secondary.__dict__,
-                    "children": []
-                }
-                
-                # 添加三级标签
-                tertiary_tags = [child for child in secondary.children if child.level == TagLevel.TERTIARY and child.is_active]
-                tertiary_tags.sort(key=lambda x: (x.sort_order, x.name))
-                
-                secondary_dict["children"] = [TaskTagResponse(**tertiary.__dict__) for tertiary in tertiary_tags]
-                tag_dict["children"].append(TaskTagResponse(**secondary_dict))
-        
-        primary_tags_data.append(TaskTagResponse(**tag_dict))
     
-    return ResponseBase(
-        data=TaskTagHierarchyResponse(primary_tags=primary_tags_data)
+    result = await db.execute(
+        select(*TaskTag.__table__.c)
+        .join(tag_tree, TaskTag.id == tag_tree.c.id)
+        .order_by(TaskTag.sort_order, TaskTag.name)
     )
+    
+    # 结果已按排序字段排好，按顺序挂到父标签下即保持同级有序
+    rows = result.mappings().all()
+    nodes = {row["id"]: {**row, "children": []} for row in rows}
+    primary_tags = []
+    for row in rows:
+        node = nodes[row["id"]]
+        if row["level"] == TagLevel.PRIMARY:
+            primary_tags.append(node)
+        else:
+            nodes[row["parent_id"]]["children"].append(node)
+    
+    body = _dump_response({"primary_tags": primary_tags}).decode()
+    await set_cached_tag_hierarchy(body)
+    
+    return Response(content=body, media_type="application/json")
 
 
 @router.get("/list", response_model=ResponseBase[List[TaskTagResponse]])
@@ -98,6 +122,7 @@ async def get_tags(
         conditions.append(TaskTag.parent_id == parent_id)
     
     if keyword:
+        # PostgreSQL 上由三列的 trigram GIN 索引支持（见 database._upgrade_schema）
         conditions.append(
             or_(
                 TaskTag.name.contains(keyword),
@@ -110,15 +135,15 @@ async def get_tags(
         conditions.append(TaskTag.is_active == True)
     
     result = await db.execute(
-        select(TaskTag)
+        select(*TaskTag.__table__.c)
         .where(and_(*conditions))
         .order_by(TaskTag.sort_order, TaskTag.name)
     )
-    tags = result.scalars().all()
     
-    tags_data = [TaskTagResponse(**tag.__dict__) for tag in tags]
+    # 数据来自数据库，行直接序列化，跳过 ORM 对象和 Pydantic 校验
+    tags_data = [{**row, "children": []} for row in result.mappings().all()]
     
-    return ResponseBase(data=tags_data)
+    return Response(content=_dump_response(tags_data), media_type="application/json")
 
 
 @router.post("/create", response_model=ResponseBase[TaskTagResponse])
@@ -130,58 +155,64 @@ async def create_tag(
     """
     创建标签（教师专用）
     """
+    # 父标签级别和重名检查合并为一条查询
+    level = TagLevel(tag_data.level)
+    check_result = await db.execute(
+        select(
+            select(TaskTag.level)
+            .where(TaskTag.id == tag_data.parent_id)
+            .scalar_subquery()
+            .label("parent_level"),
+            exists().where(
+                and_(
+                    TaskTag.name == tag_data.name,
+                    TaskTag.level == level,
+                    TaskTag.parent_id == tag_data.parent_id
+                )
+            ).label("duplicate")
+        )
+    )
+    parent_level, duplicate = check_result.one()
+    
     # 验证父标签
     if tag_data.parent_id:
-        parent_result = await db.execute(
-            select(TaskTag).where(TaskTag.id == tag_data.parent_id)
-        )
-        parent_tag = parent_result.scalar_one_or_none()
-        
-        if not parent_tag:
+        if parent_level is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="父标签不存在"
             )
         
         # 验证层级关系
-        if tag_data.level == TagLevel.SECONDARY and parent_tag.level != TagLevel.PRIMARY:
+        if level == TagLevel.SECONDARY and parent_level != TagLevel.PRIMARY:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="二级标签的父标签必须是一级标签"
             )
-        elif tag_data.level == TagLevel.TERTIARY and parent_tag.level != TagLevel.SECONDARY:
+        elif level == TagLevel.TERTIARY and parent_level != TagLevel.SECONDARY:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="三级标签的父标签必须是二级标签"
             )
     
     # 检查标签名称是否重复
-    existing_result = await db.execute(
-        select(TaskTag).where(
-            and_(
-                TaskTag.name == tag_data.name,
-                TaskTag.level == tag_data.level,
-                TaskTag.parent_id == tag_data.parent_id
-            )
-        )
-    )
-    existing_tag = existing_result.scalar_one_or_none()
-    
-    if existing_tag:
+    if duplicate:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="同级别下标签名称不能重复"
         )
     
-    # 创建标签
-    tag = TaskTag(**tag_data.dict())
-    
-    db.add(tag)
+    # 创建标签，RETURNING 直接取回整行，不再 refresh
+    insert_result = await db.execute(
+        insert(TaskTag)
+        .values(**{**tag_data.dict(), "level": level})
+        .returning(*TaskTag.__table__.c)
+    )
+    tag_row = insert_result.mappings().one()
     await db.commit()
-    await db.refresh(tag)
+    await invalidate_tag_hierarchy()
     
     return ResponseBase(
-        data=TaskTagResponse(**tag.__dict__),
+        data=TaskTagResponse(**tag_row),
         msg="标签创建成功"
     )
 
@@ -198,46 +229,52 @@ async def update_tag(
     """
     # 查询标签
     result = await db.execute(
-        select(TaskTag).where(TaskTag.id == tag_id)
+        select(*TaskTag.__table__.c).where(TaskTag.id == tag_id)
     )
-    tag = result.scalar_one_or_none()
+    tag_row = result.mappings().one_or_none()
     
-    if not tag:
+    if not tag_row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="标签不存在"
         )
     
     # 检查名称重复（如果修改了名称）
-    if tag_data.name and tag_data.name != tag.name:
-        existing_result = await db.execute(
-            select(TaskTag).where(
-                and_(
-                    TaskTag.name == tag_data.name,
-                    TaskTag.level == tag.level,
-                    TaskTag.parent_id == tag.parent_id,
-                    TaskTag.id != tag_id
+    if tag_data.name and tag_data.name != tag_row["name"]:
+        duplicate = await db.scalar(
+            select(
+                exists().where(
+                    and_(
+                        TaskTag.name == tag_data.name,
+                        TaskTag.level == tag_row["level"],
+                        TaskTag.parent_id == tag_row["parent_id"],
+                        TaskTag.id != tag_id
+                    )
                 )
             )
         )
-        existing_tag = existing_result.scalar_one_or_none()
         
-        if existing_tag:
+        if duplicate:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="同级别下标签名称不能重复"
             )
     
-    # 更新数据
+    # 更新数据，RETURNING 直接取回更新后的整行，不再 refresh
     update_data = tag_data.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(tag, field, value)
-    
-    await db.commit()
-    await db.refresh(tag)
+    if update_data:
+        update_result = await db.execute(
+            update(TaskTag)
+            .where(TaskTag.id == tag_id)
+            .values(**update_data)
+            .returning(*TaskTag.__table__.c)
+        )
+        tag_row = update_result.mappings().one()
+        await db.commit()
+        await invalidate_tag_hierarchy()
     
     return ResponseBase(
-        data=TaskTagResponse(**tag.__dict__),
+        data=TaskTagResponse(**tag_row),
         msg="标签更新成功"
     )
 
@@ -265,11 +302,18 @@ async def delete_tag(
         )
     
     if not force:
-        # 检查是否有子标签
-        children_result = await db.execute(
-            select(func.count(TaskTag.id)).where(TaskTag.parent_id == tag_id)
+        # 子标签数和使用次数一条查询取回
+        counts_result = await db.execute(
+            select(
+                select(func.count(TaskTag.id))
+                .where(TaskTag.parent_id == tag_id)
+                .scalar_subquery(),
+                select(func.count(TaskTagUsage.id))
+                .where(TaskTagUsage.tag_id == tag_id)
+                .scalar_subquery()
+            )
         )
-        children_count = children_result.scalar() or 0
+        children_count, usage_count = counts_result.one()
         
         if children_count > 0:
             raise HTTPException(
@@ -278,11 +322,6 @@ async def delete_tag(
             )
         
         # 检查是否被任务使用
-        usage_result = await db.execute(
-            select(func.count(TaskTagUsage.id)).where(TaskTagUsage.tag_id == tag_id)
-        )
-        usage_count = usage_result.scalar() or 0
-        
         if usage_count > 0:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -292,6 +331,7 @@ async def delete_tag(
     # 删除标签（级联删除子标签和使用记录）
     await db.delete(tag)
     await db.commit()
+    await invalidate_tag_hierarchy()
     
     return ResponseBase(msg="标签删除成功")
 
@@ -304,13 +344,7 @@ async def get_tag_stats(
     """
     获取标签统计信息（教师专用）
     """
-    # 总标签数
-    total_result = await db.execute(
-        select(func.count(TaskTag.id))
-    )
-    total_tags = total_result.scalar() or 0
-    
-    # 各级别标签数量
+    # 各级别标签数量，总数由各级别相加得到
     level_stats_result = await db.execute(
         select(
             TaskTag.level,
@@ -319,17 +353,18 @@ async def get_tag_stats(
         .group_by(TaskTag.level)
     )
     level_stats = {level: count for level, count in level_stats_result.all()}
+    total_tags = sum(level_stats.values())
     
     # 最常用的标签（按使用次数排序）
     most_used_result = await db.execute(
-        select(TaskTag)
+        select(*TaskTag.__table__.c)
         .where(TaskTag.usage_count > 0)
         .order_by(desc(TaskTag.usage_count))
         .limit(10)
     )
     most_used_tags = [
-        TaskTagResponse(**tag.__dict__)
-        for tag in most_used_result.scalars().all()
+        TaskTagResponse.model_construct(**row)
+        for row in most_used_result.mappings().all()
     ]
     
     return ResponseBase(
@@ -355,47 +390,54 @@ async def batch_create_tags(
     created_tags = []
     errors = []
     
+    # 一次查出所有用到的父标签和可能重名的已有标签，循环内不再逐条查询
+    parent_ids = {tag_data.parent_id for tag_data in tags_data if tag_data.parent_id}
+    parent_levels = {}
+    if parent_ids:
+        parent_result = await db.execute(
+            select(TaskTag.id, TaskTag.level).where(TaskTag.id.in_(parent_ids))
+        )
+        parent_levels = {parent_id: TagLevel(level) for parent_id, level in parent_result.all()}
+    
+    names = {tag_data.name for tag_data in tags_data}
+    existing_keys = set()
+    if names:
+        existing_result = await db.execute(
+            select(TaskTag.name, TaskTag.level, TaskTag.parent_id).where(TaskTag.name.in_(names))
+        )
+        existing_keys = {(name, TagLevel(level), parent_id) for name, level, parent_id in existing_result.all()}
+    
     for i, tag_data in enumerate(tags_data):
         try:
-            # 验证父标签
+            level = TagLevel(tag_data.level)
+            
+            # 验证父标签及层级关系（与单个创建的规则一致）
             if tag_data.parent_id:
-                parent_result = await db.execute(
-                    select(TaskTag).where(TaskTag.id == tag_data.parent_id)
-                )
-                parent_tag = parent_result.scalar_one_or_none()
-                
-                if not parent_tag:
+                parent_level = parent_levels.get(tag_data.parent_id)
+                if parent_level is None:
                     errors.append(f"第{i+1}个标签：父标签不存在")
                     continue
+                if level in _PARENT_LEVEL_RULES and parent_level != _PARENT_LEVEL_RULES[level][0]:
+                    errors.append(f"第{i+1}个标签：{_PARENT_LEVEL_RULES[level][1]}")
+                    continue
             
-            # 检查重复
-            existing_result = await db.execute(
-                select(TaskTag).where(
-                    and_(
-                        TaskTag.name == tag_data.name,
-                        TaskTag.level == tag_data.level,
-                        TaskTag.parent_id == tag_data.parent_id
-                    )
-                )
-            )
-            existing_tag = existing_result.scalar_one_or_none()
-            
-            if existing_tag:
+            # 检查重复（包括本批次中已创建的标签）
+            key = (tag_data.name, level, tag_data.parent_id)
+            if key in existing_keys:
                 errors.append(f"第{i+1}个标签：名称已存在")
                 continue
             
-            # 创建标签
-            tag = TaskTag(**tag_data.dict())
-            db.add(tag)
-            created_tags.append(tag)
+            # 创建标签（循环结束后一次性插入）
+            created_tags.append({**tag_data.dict(), "level": level})
+            existing_keys.add(key)
             
         except Exception as e:
             errors.append(f"第{i+1}个标签：{str(e)}")
     
     if created_tags:
+        await db.execute(insert(TaskTag).values(created_tags))
         await db.commit()
-        for tag in created_tags:
-            await db.refresh(tag)
+        await invalidate_tag_hierarchy()
     
     result_msg = f"成功创建{len(created_tags)}个标签"
     if errors:
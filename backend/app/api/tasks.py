@@ -2,32 +2,183 @@
 Task management API endpoints
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from fastapi import status as http_status
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc, and_, func, case
-from typing import Optional, List, Dict
+from sqlalchemy.orm import load_only
+from sqlalchemy import select, exists, desc, and_, or_, func, case, tuple_, lambda_stmt
+from typing import Optional, List
 from datetime import datetime
+import asyncio
+import logging
 import zipfile
-import io
 import os
-import requests
+import httpx
+import orjson
 from urllib.parse import urlparse
 
 from app.database import get_db
-from app.models import Task, TaskStatus, TaskType, User, Submission, SubmissionStatus, CheckinType
-from app.utils.task_status import calculate_display_status, get_task_priority
-from app.services.async_learning_data import trigger_checkin_async
+from app.models import Task, TaskStatus, TaskType, User, Submission, SubmissionStatus, Grade, CheckinType
+from app.utils.task_status import calculate_display_status, get_task_priority, china_now
+from app.utils.task_cache import invalidate_task_title
+from app.utils.task_list_cache import (
+    build_task_cache_key, get_cached_task_response, set_cached_task_response, invalidate_task_lists
+)
+from app.utils.pagination import decode_ranked_cursor, page_with_ranked_cursor
+from app.services.async_learning_data import trigger_checkin_async, run_in_background_session
 from app.schemas import (
     ResponseBase, TaskCreate, TaskUpdate, TaskInfo, 
     TaskListResponse, TaskCreateWithTags, TaskUpdateWithTags, TaskInfoWithTags
 )
 from app.auth import get_current_user, get_current_teacher, get_current_premium_user, security
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/tasks")
 
+# 打包下载提交图片时每批并发获取的图片数
+IMAGE_DOWNLOAD_CONCURRENCY = 16
+
+
+def _ok_response(data, msg: str = "ok") -> ORJSONResponse:
+    """
+    读接口直接返回 orjson 序列化的 {code, msg, data}（datetime/枚举原生支持），
+    跳过 response_model 校验和 jsonable_encoder 的逐字段遍历
+    """
+    return ORJSONResponse({"code": 0, "msg": msg, "data": data})
+
+
+async def _cached_ok_response(cache_key: Optional[str], data, msg: str = "ok") -> Response:
+    """同 _ok_response，序列化后的响应体同时写入任务列表缓存"""
+    body = orjson.dumps({"code": 0, "msg": msg, "data": data}).decode()
+    await set_cached_task_response(cache_key, body)
+    return Response(content=body, media_type="application/json")
+
+
+def _task_list_item(task: Task, submission: Optional[Submission], now: Optional[datetime] = None) -> dict:
+    """
+    任务列表的一行：字段与 TaskInfo.dict() 一致，再加上展示状态和排序优先级。
+    直接从 ORM 属性组装，不逐行构造 Pydantic 模型
+    """
+    # 使用新的状态计算工具
+    display_status = calculate_display_status(task, submission, now)
+    
+    return {
+        "id": task.id,
+        "title": task.title,
+        "course": task.course,
+        "desc": task.desc,
+        "total_score": float(task.total_score),
+        "deadline": task.deadline,
+        "live_start_time": task.live_start_time,
+        "status": task.status.value,
+        "task_type": task.task_type.value if task.task_type else None,
+        "created_by": task.created_by,
+        "created_at": task.created_at,
+        "submission_status": submission.status.value if submission else "未提交",
+        "submission_grade": submission.grade.value if submission and submission.grade else None,
+        "submission_score": submission.score if submission else None,
+        "display_right_status": display_status["right_status"],
+        "display_left_status": display_status["left_status"],
+        "display_card_style": display_status["card_style"],
+        "sort_priority": get_task_priority(task, submission)
+    }
+
+
+# 任务列表的显示优先级（与 get_task_priority 规则一致），先按优先级再按创建时间倒序，分页基于最终顺序；
+# Submission 是列表查询里 LEFT JOIN 的当前用户最新一次提交
+_TASK_SORT_PRIORITY = case(
+    (
+        and_(
+            Task.task_type == TaskType.EXTRA,
+            or_(Submission.id.is_(None), Submission.status != SubmissionStatus.GRADED)
+        ),
+        1
+    ),
+    (Task.status == TaskStatus.ONGOING, 2),
+    (and_(Task.status == TaskStatus.ENDED, Submission.status == SubmissionStatus.SUBMITTED), 3),
+    (Submission.status == SubmissionStatus.GRADED, 4),
+    else_=5
+)
+
+
+# 任务列表只加载 _task_list_item 用到的列：任务不取预留字段，提交不取图片/文字/评语等大字段
+_TASK_LIST_TASK_COLUMNS = load_only(
+    Task.id, Task.title, Task.course, Task.desc, Task.total_score, Task.deadline,
+    Task.live_start_time, Task.status, Task.task_type, Task.created_by, Task.created_at
+)
+_TASK_LIST_SUBMISSION_COLUMNS = load_only(Submission.status, Submission.grade, Submission.score)
+
+
+def _apply_task_filters(stmt, status: Optional[str], now: datetime, keyword: str, hide_drafts: bool):
+    """
+    给任务列表/计数的 lambda_stmt 追加筛选条件；每个分支是独立的 lambda，
+    语句结构按筛选组合各缓存一份，now 和关键词作为绑定参数
+    """
+    if status == "ongoing":
+        # Ongoing: status is ONGOING and deadline not passed (or no deadline)
+        stmt += lambda s: s.where(
+            Task.status == TaskStatus.ONGOING,
+            or_(Task.deadline.is_(None), Task.deadline > now)
+        )
+    elif status == "ended":
+        # Ended: status is ENDED or (status is ONGOING but deadline passed)
+        stmt += lambda s: s.where(
+            or_(
+                Task.status == TaskStatus.ENDED,
+                and_(
+                    Task.status == TaskStatus.ONGOING,
+                    Task.deadline.is_not(None),
+                    Task.deadline <= now
+                )
+            )
+        )
+    
+    if keyword:
+        # PostgreSQL 上由 ix_tasks_title_trgm（pg_trgm GIN）支持，不用全表扫描
+        pattern = f"%{keyword}%"
+        stmt += lambda s: s.where(Task.title.ilike(pattern))
+    
+    if hide_drafts:
+        stmt += lambda s: s.where(Task.status != TaskStatus.DRAFT)
+    
+    return stmt
+
+
+async def _get_task_or_404(
+    db: AsyncSession,
+    task_id: int,
+    owner: Optional[User] = None,
+    forbidden_detail: str = "只能操作自己创建的任务",
+    columns: tuple = ()
+) -> Task:
+    """
+    按 ID 取任务，不存在时 404；传入 owner 时校验任务由该用户创建，否则 403。
+    columns 指定时只加载这些列（主键总会加载），用于只读少数字段的接口
+    """
+    query = select(Task).where(Task.id == task_id)
+    if columns:
+        if owner is not None:
+            columns = (*columns, Task.created_by)
+        query = query.options(load_only(*columns))
+    task = await db.scalar(query)
+    
+    if not task:
+        raise HTTPException(
+            status_code=http_status.HTTP_404_NOT_FOUND,
+            detail="任务不存在"
+        )
+    
+    if owner is not None and task.created_by != owner.id:
+        raise HTTPException(
+            status_code=http_status.HTTP_403_FORBIDDEN,
+            detail=forbidden_detail
+        )
+    
+    return task
+
 
 @router.post("/", response_model=ResponseBase)
 async def create_task(
@@ -51,9 +202,10 @@ async def create_task(
         created_by=current_user.id
     )
     
+    # 主键在 flush 时已回填（会话 expire_on_commit=False），响应只要 id，不需要再 refresh 查一次
     db.add(new_task)
     await db.commit()
-    await db.refresh(new_task)
+    await invalidate_task_lists()
     
     return ResponseBase(
         data={"id": new_task.id},
@@ -67,176 +219,189 @@ async def list_tasks(
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
     keyword: str = Query("", description="搜索关键词"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 page"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     List all tasks with submission status for current user
     Fixed: status parameter conflict, proper count query, optimized N+1
+    
+    翻页可用 page（OFFSET）或 cursor：cursor 按 (优先级, created_at, id) 定位，深翻页不用扫描跳过的行
     """
+    # 响应按用户和查询参数缓存，任务或该用户的提交变化时失效
+    cache_key = await build_task_cache_key(current_user.id, "list", status, page, page_size, keyword, cursor)
+    cached = await get_cached_task_response(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
     try:
-        # 1) Build unified filters - consider deadline-based status
-        filters = []
-        # Use Chinese time (UTC+8) as standard time for the app
-        from datetime import timezone, timedelta
-        china_tz = timezone(timedelta(hours=8))
-        now_china = datetime.now(china_tz)
-        # Convert to naive datetime for comparison with database
-        now = now_china.replace(tzinfo=None)
+        # 北京时间（naive），截止时间筛选和展示状态共用同一个值
+        now = china_now()
+        user_id = current_user.id
+        # Filter out draft tasks for students (only teachers can see drafts)
+        hide_drafts = current_user.role.value != 'teacher'
+        limit = page_size + 1
         
-        if status in ("ongoing", "ended"):
-            if status == "ongoing":
-                # Ongoing: status is ONGOING and deadline not passed (or no deadline)
-                filters.append(
-                    and_(
-                        Task.status == TaskStatus.ONGOING,
-                        case(
-                            (Task.deadline.is_(None), True),  # No deadline = ongoing
-                            else_=Task.deadline > now  # Has deadline and not passed
-                        )
-                    )
-                )
-            else:  # ended
-                # Ended: status is ENDED or (status is ONGOING but deadline passed)
-                filters.append(
-                    case(
-                        (Task.status == TaskStatus.ENDED, True),
-                        (
-                            and_(
-                                Task.status == TaskStatus.ONGOING,
-                                Task.deadline.is_not(None),
-                                Task.deadline <= now
-                            ), 
-                            True
-                        ),
-                        else_=False
+        # 截止时间相关的状态筛选、关键词和草稿过滤都在 SQL 里完成，只取当前页（多取一条判断是否有下一页）；
+        # 同一条查询 LEFT JOIN 当前用户在每个任务上最新的一次提交，每个任务最多一行。
+        # lambda_stmt 按筛选组合缓存语句结构，now/关键词/用户/分页参数每次重新绑定
+        page_query = lambda_stmt(
+            lambda: select(Task, Submission, _TASK_SORT_PRIORITY.label("sort_priority"))
+            .outerjoin(
+                Submission,
+                and_(
+                    Submission.task_id == Task.id,
+                    Submission.id.in_(
+                        select(func.max(Submission.id))
+                        .where(Submission.student_id == user_id)
+                        .group_by(Submission.task_id)
                     )
                 )
+            )
+            .order_by(_TASK_SORT_PRIORITY, desc(Task.created_at), desc(Task.id))
+            .options(_TASK_LIST_TASK_COLUMNS, _TASK_LIST_SUBMISSION_COLUMNS)
+        )
+        page_query = _apply_task_filters(page_query, status, now, keyword, hide_drafts)
+        count_query = _apply_task_filters(
+            lambda_stmt(lambda: select(func.count()).select_from(Task)),
+            status, now, keyword, hide_drafts
+        )
         
-        if keyword:
-            filters.append(Task.title.ilike(f"%{keyword}%"))
-        
-        # 2) Get all tasks first, then filter in memory for deadline-based status
-        # This is necessary because SQL case expressions in WHERE clauses are complex
-        all_tasks_query = select(Task)
-        if keyword:
-            all_tasks_query = all_tasks_query.where(Task.title.ilike(f"%{keyword}%"))
-        
-        # Filter out draft tasks for students (only teachers can see drafts)
-        if current_user.role.value != 'teacher':
-            all_tasks_query = all_tasks_query.where(Task.status != TaskStatus.DRAFT)
-            
-        all_tasks_query = all_tasks_query.order_by(desc(Task.created_at))
-        
-        all_tasks_result = await db.execute(all_tasks_query)
-        all_tasks = all_tasks_result.scalars().all()
-        
-        # Filter tasks based on deadline-aware status
-        filtered_tasks = []
-        print(f"[DEBUG] Filtering by status: {status}, Chinese time: {now_china}, naive time: {now}")
-        
-        if status == "ongoing":
-            for task in all_tasks:
-                is_ongoing = task.status == TaskStatus.ONGOING and (task.deadline is None or task.deadline > now)
-                print(f"[DEBUG] Task {task.id} ({task.title}): status={task.status}, deadline={task.deadline}, is_ongoing={is_ongoing}")
-                if is_ongoing:
-                    filtered_tasks.append(task)
-        elif status == "ended":
-            for task in all_tasks:
-                is_ended = (task.status == TaskStatus.ENDED or 
-                          (task.status == TaskStatus.ONGOING and task.deadline and task.deadline <= now))
-                print(f"[DEBUG] Task {task.id} ({task.title}): status={task.status}, deadline={task.deadline}, is_ended={is_ended}")
-                if is_ended:
-                    filtered_tasks.append(task)
-        else:
-            filtered_tasks = all_tasks
-            
-        print(f"[DEBUG] Filtered {len(filtered_tasks)} tasks from {len(all_tasks)} total tasks")
-        
-        # Apply pagination to filtered results
-        total = len(filtered_tasks)
-        offset = (page - 1) * page_size
-        tasks = filtered_tasks[offset:offset + page_size]
-    
-        # 5) Get submissions in batch to avoid N+1
-        submissions_by_task: Dict[int, object] = {}
-        if tasks:
-            task_ids = [t.id for t in tasks]
-            sub_result = await db.execute(
-                select(Submission).where(
+        if cursor:
+            # 游标分页：游标是上一页最后一条的 (优先级, created_at, id)；总数需要不带游标条件的 COUNT
+            last_priority, last_created_at, last_id = decode_ranked_cursor(cursor)
+            page_query += lambda s: s.where(
+                or_(
+                    _TASK_SORT_PRIORITY > last_priority,
                     and_(
-                        Submission.task_id.in_(task_ids),
-                        Submission.student_id == current_user.id
+                        _TASK_SORT_PRIORITY == last_priority,
+                        tuple_(Task.created_at, Task.id) < tuple_(last_created_at, last_id)
                     )
                 )
+            ).limit(limit)
+            tasks_result = await db.execute(page_query)
+            rows, next_cursor = page_with_ranked_cursor(
+                tasks_result.all(), page_size,
+                rank=lambda row: row.sort_priority, key=lambda row: row.Task
+            )
+            total = await db.scalar(count_query) or 0
+        else:
+            # 总数用窗口函数 COUNT(*) OVER () 随当前页一起返回，省一次 COUNT 查询
+            offset = (page - 1) * page_size
+            page_query += lambda s: s.add_columns(func.count().over().label("total")).limit(limit).offset(offset)
+            tasks_result = await db.execute(page_query)
+            all_rows = tasks_result.all()
+            rows, next_cursor = page_with_ranked_cursor(
+                all_rows, page_size,
+                rank=lambda row: row.sort_priority, key=lambda row: row.Task
             )
-            for sub in sub_result.scalars():
-                submissions_by_task[sub.task_id] = sub
-        
-        # 6) Process tasks
-        task_list = []
-        for task in tasks:
-            task_info = TaskInfo.from_orm(task)
-            submission = submissions_by_task.get(task.id)
             
-            if submission:
-                task_info.submission_status = submission.status.value
-                task_info.submission_grade = submission.grade.value if submission.grade else None
-                task_info.submission_score = submission.score
+            if all_rows:
+                total = all_rows[0].total
+            elif offset:
+                # 页码超出范围时当前页没有行，单独查一次总数
+                total = await db.scalar(count_query) or 0
             else:
-                task_info.submission_status = "未提交"
-            
-            # 使用新的状态计算工具
-            display_status = calculate_display_status(task, submission)
-            
-            # 将状态信息添加到任务信息中
-            task_data = task_info.dict()
-            task_data.update({
-                "display_right_status": display_status["right_status"],
-                "display_left_status": display_status["left_status"],
-                "display_card_style": display_status["card_style"],
-                "sort_priority": get_task_priority(task, submission)
-            })
-            
-            task_list.append(task_data)
-    
-        # 根据优先级和创建时间排序
-        task_list.sort(key=lambda x: (x["sort_priority"], -x.get("created_at", 0) if isinstance(x.get("created_at"), (int, float)) else 0))
+                total = 0
         
-        return ResponseBase(
-            data={
-                "tasks": task_list,
-                "total": total,
-                "page": page,
-                "page_size": page_size
-            }
-        )
+        # 3) Process tasks
+        task_list = [_task_list_item(row.Task, row.Submission, now) for row in rows]
+        
+        return await _cached_ok_response(cache_key, {
+            "tasks": task_list,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "next_cursor": next_cursor
+        })
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Tasks list error: {e}")
+        logger.exception("Tasks list error: %s", e)
         raise HTTPException(
             status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get tasks: {str(e)}"
         )
 
 
+@router.get("/summary", response_model=ResponseBase)
+async def get_task_summary(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get task summary for current user
+    获取用户任务概况统计（一条聚合查询，每个任务取该学生最新的一次提交）
+    """
+    cache_key = await build_task_cache_key(current_user.id, "summary")
+    cached = await get_cached_task_response(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
+    # 每个任务该学生最新的一次提交
+    latest_submission_ids = (
+        select(func.max(Submission.id))
+        .where(Submission.student_id == current_user.id)
+        .group_by(Submission.task_id)
+    )
+    is_graded = and_(Submission.id.is_not(None), Submission.status != SubmissionStatus.SUBMITTED)
+    
+    def count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+    
+    result = await db.execute(
+        select(
+            func.count(Task.id).label("total_tasks"),
+            count_if(Submission.id.is_(None)).label("pending_submission"),
+            count_if(Submission.status == SubmissionStatus.SUBMITTED).label("submitted"),
+            count_if(is_graded).label("graded"),
+            # 与原逻辑一致：分数为空或为 0 的不计入平均分
+            func.avg(case((and_(is_graded, Submission.score != 0), Submission.score))).label("average_score"),
+            *[count_if(and_(is_graded, Submission.grade == grade)).label(grade.value) for grade in Grade]
+        )
+        .select_from(Task)
+        .outerjoin(
+            Submission,
+            and_(
+                Submission.task_id == Task.id,
+                Submission.id.in_(latest_submission_ids)
+            )
+        )
+    )
+    row = result.one()
+    
+    grade_distribution = {
+        grade.value: row._mapping[grade.value]
+        for grade in (Grade.REVIEW, Grade.GOOD, Grade.EXCELLENT)
+    }
+    if row._mapping[Grade.PENDING.value]:
+        grade_distribution[Grade.PENDING.value] = row._mapping[Grade.PENDING.value]
+    
+    stats = {
+        "total_tasks": row.total_tasks,
+        "submitted": row.submitted,
+        "graded": row.graded,
+        "pending_submission": row.pending_submission,
+        "pending_grading": row.submitted,
+        "average_score": round(row.average_score, 1) if row.average_score else 0,
+        "grade_distribution": grade_distribution
+    }
+    
+    return await _cached_ok_response(cache_key, stats, msg="获取任务统计成功")
+
+
 @router.get("/{task_id}", response_model=ResponseBase)
 async def get_task(
     task_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_premium_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Get task details
     """
-    # Get task
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(
-            status_code=http_status.HTTP_404_NOT_FOUND,
-            detail="任务不存在"
-        )
+    task = await _get_task_or_404(db, task_id)
     
     # Students cannot access draft tasks (only teachers and task creators can)
     if task.status == TaskStatus.DRAFT and current_user.role.value != 'teacher' and task.created_by != current_user.id:
@@ -265,19 +430,16 @@ async def get_task(
     else:
         task_info.submission_status = "未提交"
     
-    # V1.0 学习数据统计：记录任务查看打卡
-    try:
-        await trigger_checkin_async(
-            user_id=current_user.id,
-            checkin_type=CheckinType.TASK_VIEW,
-            db=db,
-            related_task_id=task_id
-        )
-    except Exception as e:
-        # 学习数据记录失败不应影响主业务流程
-        print(f"任务查看打卡记录失败: {e}")
+    # V1.0 学习数据统计：记录任务查看打卡（响应返回后执行，失败只记日志）
+    background_tasks.add_task(
+        run_in_background_session,
+        trigger_checkin_async,
+        user_id=current_user.id,
+        checkin_type=CheckinType.TASK_VIEW,
+        related_task_id=task_id
+    )
     
-    return ResponseBase(data=task_info.dict())
+    return _ok_response(task_info.dict())
 
 
 @router.put("/{task_id}", response_model=ResponseBase)
@@ -290,22 +452,7 @@ async def update_task(
     """
     Update task (teacher only)
     """
-    # Get task
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(
-            status_code=http_status.HTTP_404_NOT_FOUND,
-            detail="任务不存在"
-        )
-    
-    # Check ownership
-    if task.created_by != current_user.id:
-        raise HTTPException(
-            status_code=http_status.HTTP_403_FORBIDDEN,
-            detail="只能修改自己创建的任务"
-        )
+    task = await _get_task_or_404(db, task_id, owner=current_user, forbidden_detail="只能修改自己创建的任务")
     
     # Update fields
     update_data = task_data.dict(exclude_unset=True)
@@ -314,6 +461,8 @@ async def update_task(
     
     await db.commit()
     await db.refresh(task)
+    invalidate_task_title(task_id)
+    await invalidate_task_lists()
     
     return ResponseBase(msg="任务更新成功")
 
@@ -327,28 +476,17 @@ async def delete_task(
     """
     Delete task (teacher only)
     """
-    # Get task
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(
-            status_code=http_status.HTTP_404_NOT_FOUND,
-            detail="任务不存在"
-        )
-    
-    # Check ownership
-    if task.created_by != current_user.id:
-        raise HTTPException(
-            status_code=http_status.HTTP_403_FORBIDDEN,
-            detail="只能删除自己创建的任务"
-        )
+    # 删除只需要判断归属，其余列不用加载
+    task = await _get_task_or_404(
+        db, task_id, owner=current_user, forbidden_detail="只能删除自己创建的任务",
+        columns=(Task.created_by,)
+    )
     
-    # Check if there are submissions
-    sub_result = await db.execute(
-        select(Submission).where(Submission.task_id == task_id)
+    # Check if there are submissions（只判断是否存在，不加载提交记录）
+    has_submissions = await db.scalar(
+        select(exists().where(Submission.task_id == task_id))
     )
-    if sub_result.scalar_one_or_none():
+    if has_submissions:
         raise HTTPException(
             status_code=http_status.HTTP_400_BAD_REQUEST,
             detail="已有学生提交作业，无法删除任务"
@@ -356,6 +494,8 @@ async def delete_task(
     
     await db.delete(task)
     await db.commit()
+    invalidate_task_title(task_id)
+    await invalidate_task_lists()
     
     return ResponseBase(msg="任务删除成功")
 
@@ -369,19 +509,12 @@ async def toggle_task_status(
     """
     Toggle task status between ongoing and ended (teacher only)
     """
-    # Get task
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(
-            status_code=http_status.HTTP_404_NOT_FOUND,
-            detail="任务不存在"
-        )
+    task = await _get_task_or_404(db, task_id, columns=(Task.status,))
     
     # Toggle status
     task.status = TaskStatus.ENDED if task.status == TaskStatus.ONGOING else TaskStatus.ONGOING
     await db.commit()
+    await invalidate_task_lists()
     
     return ResponseBase(
         data={"new_status": task.status.value},
@@ -399,15 +532,8 @@ async def generate_share_link(
     Generate share link for task (teacher only)
     生成任务分享链接，支持微信分享和深链接
     """
-    # Get task
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(
-            status_code=http_status.HTTP_404_NOT_FOUND,
-            detail="任务不存在"
-        )
+    # 分享只用到标题
+    task = await _get_task_or_404(db, task_id, columns=(Task.title,))
     
     # Generate share data
     share_data = {
@@ -423,69 +549,6 @@ async def generate_share_link(
         msg="分享链接生成成功"
     )
 # 在现有tasks.py末尾添加增强版任务概况API
-@router.get("/summary", response_model=ResponseBase) 
-async def get_task_summary(
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
-):
-    """
-    Get task summary for current user
-    获取用户任务概况统计
-    """
-    from sqlalchemy import func
-    
-    # Get all tasks
-    tasks_result = await db.execute(select(Task))
-    all_tasks = tasks_result.scalars().all()
-    
-    # Get user submissions
-    submissions_result = await db.execute(
-        select(Submission).where(Submission.student_id == current_user.id)
-    )
-    submissions = submissions_result.scalars().all()
-    
-    # Create submission lookup
-    submission_by_task = {s.task_id: s for s in submissions}
-    
-    # Calculate statistics
-    stats = {
-        "total_tasks": len(all_tasks),
-        "submitted": 0,
-        "graded": 0,
-        "pending_submission": 0,
-        "pending_grading": 0,
-        "average_score": 0,
-        "grade_distribution": {"review": 0, "good": 0, "excellent": 0}
-    }
-    
-    graded_scores = []
-    
-    for task in all_tasks:
-        submission = submission_by_task.get(task.id)
-        
-        if not submission:
-            stats["pending_submission"] += 1
-        elif submission.status == SubmissionStatus.SUBMITTED:
-            stats["submitted"] += 1
-            stats["pending_grading"] += 1
-        else:  # GRADED
-            stats["graded"] += 1
-            if submission.score:
-                graded_scores.append(submission.score)
-            if submission.grade:
-                stats["grade_distribution"][submission.grade.value] = \
-                    stats["grade_distribution"].get(submission.grade.value, 0) + 1
-    
-    # Calculate average score
-    if graded_scores:
-        stats["average_score"] = round(sum(graded_scores) / len(graded_scores), 1)
-    
-    return ResponseBase(
-        data=stats,
-        msg="获取任务统计成功"
-    )
-
-
 async def get_current_user_from_token_or_header(
     token: Optional[str] = Query(None, description="URL token for browser downloads"),
     db: AsyncSession = Depends(get_db)
@@ -499,7 +562,7 @@ async def get_current_user_from_token_or_header(
     
     if not auth_token:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
+            status_code=http_status.HTTP_401_UNAUTHORIZED,
             detail="No authentication token provided",
             headers={"WWW-Authenticate": "Bearer"},
         )
@@ -510,7 +573,7 @@ async def get_current_user_from_token_or_header(
     
     if user_id is None:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
+            status_code=http_status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
@@ -521,7 +584,7 @@ async def get_current_user_from_token_or_header(
     
     if user is None:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
+            status_code=http_status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
@@ -529,6 +592,98 @@ async def get_current_user_from_token_or_header(
     return user
 
 
+def _read_local_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def _fetch_image(client: httpx.AsyncClient, image_url: str) -> bytes:
+    """获取一张提交图片：相对路径读本地文件（放到线程里读），绝对URL通过HTTP下载"""
+    # 处理相对路径URL
+    if image_url.startswith('/'):
+        # 相对路径，转换为本地文件路径
+        local_file_path = f".{image_url}"
+        if not os.path.exists(local_file_path):
+            raise FileNotFoundError(f"Local file not found: {local_file_path}")
+        return await asyncio.to_thread(_read_local_file, local_file_path)
+    
+    # 绝对URL，通过HTTP下载
+    response = await client.get(image_url)
+    response.raise_for_status()
+    return response.content
+
+
+class _ZipChunkWriter:
+    """
+    只追加的 ZIP 写入目标：没有 tell/seek，zipfile 按不可 seek 的流写入（条目后带数据描述符），
+    写入的字节由流式响应逐块取走，不在内存里保留整个压缩包
+    """
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _write_zip_entries(zip_file: zipfile.ZipFile, batch: list, image_contents: list):
+    """把一批图片写进 ZIP（压缩在线程里执行）；获取失败的图片写一个错误说明文件"""
+    for (folder_name, i, image_url), image_content in zip(batch, image_contents):
+        if isinstance(image_content, Exception):
+            # 如果某张图片下载失败，创建错误文件说明
+            error_msg = f"图片下载失败: {str(image_content)}\n原始URL: {image_url}"
+            error_filename = f"{folder_name}/error_image_{i+1}.txt"
+            zip_file.writestr(error_filename, error_msg)
+            continue
+        
+        # 获取文件扩展名
+        parsed_url = urlparse(image_url)
+        path = parsed_url.path
+        file_ext = os.path.splitext(path)[1] or '.jpg'
+        
+        # 生成文件名
+        filename = f"image_{i+1}{file_ext}"
+        full_path = f"{folder_name}/{filename}"
+        
+        # 添加到ZIP
+        zip_file.writestr(full_path, image_content)
+
+
+async def _stream_submissions_zip(entries: list):
+    """
+    边获取图片边生成 ZIP：每批最多 IMAGE_DOWNLOAD_CONCURRENCY 张并发获取，写入后立即把压缩数据发给客户端，
+    内存里只保留当前这一批图片
+    entries: [(学生文件夹, 序号, URL), ...]
+    """
+    writer = _ZipChunkWriter()
+    async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for start in range(0, len(entries), IMAGE_DOWNLOAD_CONCURRENCY):
+                batch = entries[start:start + IMAGE_DOWNLOAD_CONCURRENCY]
+                # 单张失败时返回异常对象，不影响同批其他图片
+                image_contents = await asyncio.gather(
+                    *(_fetch_image(client, image_url) for _, _, image_url in batch),
+                    return_exceptions=True
+                )
+                await asyncio.to_thread(_write_zip_entries, zip_file, batch, image_contents)
+                chunk = writer.pop()
+                if chunk:
+                    yield chunk
+    # 关闭 ZipFile 时写入的中央目录
+    chunk = writer.pop()
+    if chunk:
+        yield chunk
+
+
 @router.get("/{task_id}/download-latest-submissions")
 async def download_latest_submissions(
     task_id: int,
@@ -549,80 +704,45 @@ async def download_latest_submissions(
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     
-    # 查询每个学生的最新提交
-    # 使用子查询找到每个学生的最大created_at，然后匹配对应的submission
-    latest_submissions_subquery = select(
-        Submission.student_id,
-        func.max(Submission.created_at).label('latest_created_at')
-    ).where(Submission.task_id == task_id).group_by(Submission.student_id).subquery()
+    # 查询每个学生的最新提交：ROW_NUMBER() 按学生分区、按 created_at 倒序编号，取第一条
+    # （created_at 相同时按 id 决定，每个学生只会有一行）；只取打包需要的列
+    ranked_submissions = select(
+        Submission.id,
+        func.row_number().over(
+            partition_by=Submission.student_id,
+            order_by=(Submission.created_at.desc(), Submission.id.desc())
+        ).label('rn')
+    ).where(Submission.task_id == task_id).subquery()
     
-    latest_submissions_query = select(Submission).join(
-        latest_submissions_subquery,
-        and_(
-            Submission.student_id == latest_submissions_subquery.c.student_id,
-            Submission.created_at == latest_submissions_subquery.c.latest_created_at,
-            Submission.task_id == task_id
-        )
-    ).order_by(Submission.student_id)
+    latest_submissions_query = select(Submission.student_id, Submission.images).join(
+        ranked_submissions, Submission.id == ranked_submissions.c.id
+    ).where(ranked_submissions.c.rn == 1).order_by(Submission.student_id)
     
     submissions_result = await db.execute(latest_submissions_query)
-    submissions = submissions_result.scalars().all()
+    submissions = submissions_result.all()
     
     if not submissions:
         raise HTTPException(status_code=404, detail="该任务下没有任何提交")
     
-    # 创建ZIP文件内容
-    zip_buffer = io.BytesIO()
+    # 一次查出所有学生的昵称，避免循环里逐个查询
+    student_ids = {submission.student_id for submission in submissions}
+    nickname_result = await db.execute(
+        select(User.id, User.nickname).where(User.id.in_(student_ids))
+    )
+    nickname_by_id = dict(nickname_result.all())
     
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for submission in submissions:
-            # 获取学生信息
-            student_result = await db.execute(select(User).where(User.id == submission.student_id))
-            student = student_result.scalar_one_or_none()
-            student_name = student.nickname if student else f"用户{submission.student_id}"
-            
-            # 创建学生文件夹
-            folder_name = f"{student_name}_{submission.student_id}"
-            
-            # 处理图片列表
-            images = submission.images if submission.images else []
-            
-            for i, image_url in enumerate(images):
-                try:
-                    # 处理相对路径URL
-                    if image_url.startswith('/'):
-                        # 相对路径，转换为本地文件路径
-                        local_file_path = f".{image_url}"
-                        if os.path.exists(local_file_path):
-                            with open(local_file_path, 'rb') as f:
-                                image_content = f.read()
-                        else:
-                            raise FileNotFoundError(f"Local file not found: {local_file_path}")
-                    else:
-                        # 绝对URL，通过HTTP下载
-                        response = requests.get(image_url, timeout=30)
-                        response.raise_for_status()
-                        image_content = response.content
-                    
-                    # 获取文件扩展名
-                    parsed_url = urlparse(image_url)
-                    path = parsed_url.path
-                    file_ext = os.path.splitext(path)[1] or '.jpg'
-                    
-                    # 生成文件名
-                    filename = f"image_{i+1}{file_ext}"
-                    full_path = f"{folder_name}/{filename}"
-                    
-                    # 添加到ZIP
-                    zip_file.writestr(full_path, image_content)
-                    
-                except Exception as e:
-                    # 如果某张图片下载失败，创建错误文件说明
-                    error_msg = f"图片下载失败: {str(e)}\n原始URL: {image_url}"
-                    error_filename = f"{folder_name}/error_image_{i+1}.txt"
-                    zip_file.writestr(error_filename, error_msg)
-    
-    zip_buffer.seek(0)
+    # 每张图片对应的 (学生文件夹, 序号, URL)
+    entries = []
+    for submission in submissions:
+        # 获取学生信息
+        student_name = nickname_by_id.get(submission.student_id) or f"用户{submission.student_id}"
+        
+        # 创建学生文件夹
+        folder_name = f"{student_name}_{submission.student_id}"
+        
+        # 处理图片列表
+        images = submission.images if submission.images else []
+        entries.extend((folder_name, i, image_url) for i, image_url in enumerate(images))
     
     # 生成文件名（使用ASCII安全字符）
     safe_task_title = "".join(c for c in task.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
@@ -635,7 +755,7 @@ async def download_latest_submissions(
     safe_filename = filename.encode('ascii', 'ignore').decode('ascii')
     
     return StreamingResponse(
-        io.BytesIO(zip_buffer.read()),
+        _stream_submissions_zip(entries),
         media_type="application/zip",
         headers={"Content-Disposition": f"attachment; filename={safe_filename}"}
     )
@@ -2,19 +2,23 @@
 Authentication and authorization utilities
 """
 
+import logging
 from datetime import datetime, timedelta
 from typing import Optional
+from cachetools import TTLCache
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, event
+from sqlalchemy.orm import make_transient_to_detached
 
 from app.config import settings
 from app.database import get_db
 from app.models import User, UserRole, SubscriptionType
 
+logger = logging.getLogger(__name__)
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -22,6 +26,39 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # Bearer token
 security = HTTPBearer()
 
+# 当前用户的短期缓存：user_id -> 列值快照。
+# 缓存快照而不是 ORM 对象，命中时 merge 进本次请求的 session，接口里修改用户照常提交。
+# 本进程内任何对 User 的 ORM 更新都会清掉对应条目；其他 worker 最多 ttl 秒内读到旧值。
+_user_cache: TTLCache = TTLCache(maxsize=4096, ttl=30)
+_USER_COLUMNS = [attr.key for attr in User.__mapper__.column_attrs]
+
+
+def invalidate_user_cache(user_id: int) -> None:
+    """清除指定用户的缓存（登出、角色/订阅变更等）"""
+    _user_cache.pop(user_id, None)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_on_change(mapper, connection, target):
+    invalidate_user_cache(target.id)
+
+
+async def _load_user(db: AsyncSession, user_id: int) -> Optional[User]:
+    """按 id 获取用户，优先使用缓存快照"""
+    snapshot = _user_cache.get(user_id)
+    if snapshot is not None:
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        # load=False：直接挂到当前 session，不再查数据库
+        return await db.merge(user, load=False)
+    
+    result = await db.execute(select(User).where(User.id == user_id))
+    user = result.scalar_one_or_none()
+    if user is not None:
+        _user_cache[user_id] = {key: getattr(user, key) for key in _USER_COLUMNS}
+    return user
+
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
@@ -39,12 +76,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 def verify_token(token: str) -> dict:
     """Verify JWT token and return payload"""
     try:
-        print(f"[AUTH] 开始验证token: {token[:20] if token and len(token) > 20 else token}")
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        print(f"[AUTH] Token验证成功, payload: {payload}")
+        logger.debug("[AUTH] Token验证成功, sub: %s", payload.get("sub"))
         return payload
     except JWTError as e:
-        print(f"[AUTH] Token验证失败: {e}")
+        logger.info("[AUTH] Token验证失败: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -57,9 +93,7 @@ async def get_current_user(
     db: AsyncSession = Depends(get_db)
 ) -> User:
     """Get current user from JWT token"""
-    print(f"[AUTH] 收到认证请求, credentials: {credentials}")
     token = credentials.credentials
-    print(f"[AUTH] 提取token: {token[:20]}..." if token and len(token) > 20 else f"[AUTH] Token: {token}")
     payload = verify_token(token)
     
     user_id_str = payload.get("sub")
@@ -78,9 +112,8 @@ async def get_current_user(
             detail="Could not validate credentials",
         )
     
-    # Get user from database
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalar_one_or_none()
+    # Get user from cache or database
+    user = await _load_user(db, user_id)
     
     if user is None:
         raise HTTPException(
@@ -19,6 +19,12 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "sqlite+aiosqlite:///./data/app.db"
+    # 连接池（仅 PostgreSQL；每个 worker 进程各一份，总连接数 = WORKERS * (池大小 + 溢出)）
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 1800  # 秒
+    # asyncpg 预编译语句缓存（每个连接）；经 pgbouncer 事务池连接时需设为 0
+    DB_STATEMENT_CACHE_SIZE: int = 256
     
     # WeChat Mini Program
     WX_APPID: str = ""
@@ -52,6 +58,9 @@ class Settings(BaseSettings):
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
     ALLOWED_IMAGE_TYPES: List[str] = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp", "application/octet-stream"]
     MAX_IMAGES_PER_SUBMISSION: int = 6
+    # 分批上传：未凑齐的文件暂存目录，以及批次状态的过期时间（秒）
+    UPLOAD_STAGING_DIR: str = "./uploads_staging"
+    UPLOAD_BATCH_TTL: int = 600
     
     # API settings
     API_V1_STR: str = "/api/v1"
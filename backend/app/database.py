@@ -2,15 +2,57 @@
 Database connection and session management
 """
 
+import logging
+
+import orjson
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+def _json_serializer(value) -> str:
+    # JSON 列统一用 orjson 序列化（比标准库 json 快）
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _async_database_url(url: str) -> str:
+    """postgresql:// 或 postgres:// 形式的连接串统一换成 asyncpg 驱动"""
+    for prefix in ("postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+DATABASE_URL = _async_database_url(settings.DATABASE_URL)
+
+# SQLite 使用默认连接池；PostgreSQL 显式配置池大小，并在取连接时检测断线
+_engine_options = {}
+if not DATABASE_URL.startswith("sqlite"):
+    _engine_options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+if DATABASE_URL.startswith("postgresql+asyncpg"):
+    # 热点查询的预编译语句按连接缓存复用，省去重复的 PARSE
+    _engine_options["connect_args"] = {
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+    }
+
 # Create async engine
 engine = create_async_engine(
-    settings.DATABASE_URL,
+    DATABASE_URL,
     echo=False,  # Set to True for SQL query logging
-    future=True
+    future=True,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+    **_engine_options
 )
 
 # Create async session factory
@@ -38,4 +80,72 @@ async def init_db():
     async with engine.begin() as conn:
         # Create all tables (checkfirst=True prevents errors if tables already exist)
         # This is safe even when multiple workers start simultaneously
-        await conn.run_sync(lambda sync_conn: Base.metadata.create_all(sync_conn, checkfirst=True))
\ No newline at end of file
+        await conn.run_sync(lambda sync_conn: Base.metadata.create_all(sync_conn, checkfirst=True))
+        await conn.run_sync(_upgrade_schema)
+
+
+_SUBMIT_COUNT_UNIQUE_INDEX = "uq_sub_task_student_count"
+
+
+def _upgrade_schema(sync_conn):
+    """
+    create_all 不会修改已存在的表，这里补上对老库的增量变更。
+    每一步都先检查当前状态，重复执行是安全的。
+    """
+    # 老表上补建模型里新增的索引；submit_count 唯一索引可能和历史数据冲突，下面单独处理
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name != _SUBMIT_COUNT_UNIQUE_INDEX:
+                index.create(sync_conn, checkfirst=True)
+    
+    # submit_count 唯一索引：历史数据里已有重复次数时跳过，避免启动失败
+    existing_indexes = {index["name"] for index in inspect(sync_conn).get_indexes("submissions")}
+    if _SUBMIT_COUNT_UNIQUE_INDEX not in existing_indexes:
+        has_duplicate_counts = sync_conn.execute(text(
+            "SELECT 1 FROM submissions GROUP BY task_id, student_id, submit_count "
+            "HAVING COUNT(*) > 1 LIMIT 1"
+        )).scalar()
+        if has_duplicate_counts:
+            logger.warning(f"submissions 存在重复的 submit_count，未创建唯一索引 {_SUBMIT_COUNT_UNIQUE_INDEX}")
+        else:
+            for index in Base.metadata.tables["submissions"].indexes:
+                if index.name == _SUBMIT_COUNT_UNIQUE_INDEX:
+                    index.create(sync_conn)
+    
+    if sync_conn.dialect.name == "postgresql":
+        # submissions.images: json -> jsonb
+        data_type = sync_conn.execute(text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = 'submissions' AND column_name = 'images'"
+        )).scalar()
+        if data_type == "json":
+            sync_conn.execute(text(
+                "ALTER TABLE submissions ALTER COLUMN images TYPE JSONB USING images::jsonb"
+            ))
+        
+        # 提交次数上限的 CHECK 约束；NOT VALID 只约束新写入的行，不校验历史数据
+        has_cap = sync_conn.execute(text(
+            "SELECT 1 FROM pg_constraint WHERE conname = 'ck_sub_submit_count_cap'"
+        )).scalar()
+        if not has_cap:
+            sync_conn.execute(text(
+                "ALTER TABLE submissions ADD CONSTRAINT ck_sub_submit_count_cap "
+                "CHECK (submit_count BETWEEN 1 AND 3) NOT VALID"
+            ))
+        
+        # 标签关键词搜索（name/display_name/description LIKE '%kw%'）和任务标题搜索（title ILIKE '%kw%'）
+        # 用的 trigram GIN 索引；需要 pg_trgm 扩展，没有建扩展权限时跳过，搜索退回顺序扫描
+        try:
+            with sync_conn.begin_nested():
+                sync_conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                for column in ("name", "display_name", "description"):
+                    sync_conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_task_tags_{column}_trgm "
+                        f"ON task_tags USING GIN ({column} gin_trgm_ops)"
+                    ))
+                sync_conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_tasks_title_trgm "
+                    "ON tasks USING GIN (title gin_trgm_ops)"
+                ))
+        except Exception as e:
+            logger.warning(f"创建关键词搜索 trigram 索引失败: {str(e)}")
@@ -2,10 +2,11 @@
 Main application entry point
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
+import logging
 import os
 
 from app.config import settings
@@ -13,8 +14,14 @@ from app.database import init_db
 from app.api import api_router
 from app.schemas import ResponseBase
 from app.services.scheduler import scheduler_service
+from app.utils.redis_client import close_redis
+from app.utils.batch_uploads import start_batch_janitor, stop_batch_janitor
 import asyncio
 
+# 应用日志：app.* 按 LOG_LEVEL 输出（生产环境 INFO，接口里的 debug 日志不会被格式化）
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("app").setLevel(settings.LOG_LEVEL)
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -22,9 +29,38 @@ app = FastAPI(
     description="公考督学助手后端API",
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    # 所有接口默认用 orjson 序列化响应
+    default_response_class=ORJSONResponse
 )
 
+# 单图上传的请求体上限：文件上限 + multipart 边界/表单字段的余量
+UPLOAD_IMAGE_PATH = f"{settings.API_V1_STR}/submissions/upload-image"
+MULTIPART_OVERHEAD = 64 * 1024
+UPLOAD_TOO_LARGE_MSG = f"文件太大，最大允许 {settings.MAX_UPLOAD_SIZE // (1024 * 1024)}MB"
+
+
+@app.middleware("http")
+async def reject_oversized_upload(request: Request, call_next):
+    """
+    在读取请求体之前按 Content-Length 拒绝超大的单图上传。
+    FastAPI 会在进入接口函数前先解析完整个 multipart 表单，接口内再检查就晚了。
+    """
+    if request.method == "POST" and request.url.path == UPLOAD_IMAGE_PATH:
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and \
+                int(content_length) > settings.MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD:
+            return ORJSONResponse(
+                status_code=400,
+                content=ResponseBase(
+                    code=400,
+                    msg=UPLOAD_TOO_LARGE_MSG,
+                    data=None
+                ).dict()
+            )
+    return await call_next(request)
+
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -43,7 +79,7 @@ if os.path.exists("uploads"):
 # Global exception handler
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content=ResponseBase(
             code=exc.status_code,
@@ -55,7 +91,7 @@ async def http_exception_handler(request, exc):
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content=ResponseBase(
             code=500,
@@ -93,15 +129,34 @@ async def health_check():
 app.include_router(api_router)
 
 
+def check_duplicate_routes():
+    """启动时检查是否有重复注册的 method + path（例如同一个 router 被 include 两次）"""
+    seen = set()
+    duplicates = []
+    for route in app.routes:
+        for method in getattr(route, "methods", None) or ():
+            key = (method, route.path)
+            if key in seen:
+                duplicates.append(f"{method} {route.path}")
+            seen.add(key)
+    if duplicates:
+        print(f"⚠️ 发现重复注册的路由: {', '.join(duplicates)}")
+    return duplicates
+
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
+    check_duplicate_routes()
     await init_db()
     
     # 启动定时任务调度器（包括艾宾浩斯复盘队列生成）
     asyncio.create_task(scheduler_service.start())
     
+    # 定期清理中途放弃的分批上传
+    start_batch_janitor()
+    
     print(f"✅ {settings.PROJECT_NAME} v{settings.VERSION} started successfully!")
     print(f"📚 API Documentation: http://localhost:8000/docs")
 
@@ -112,6 +167,8 @@ async def shutdown_event():
     """Cleanup on shutdown"""
     # 停止定时任务调度器
     await scheduler_service.stop()
+    stop_batch_janitor()
+    await close_redis()
     print(f"👋 {settings.PROJECT_NAME} shutting down...")
 
 
@@ -3,7 +3,8 @@ Database models for the application
 All models in one file for simplicity
 """
 
-from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey, Enum as SQLEnum, Float, Date, Boolean, JSON
+from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey, Enum as SQLEnum, Float, Date, Boolean, JSON, Index, CheckConstraint
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from app.database import Base
 from datetime import datetime, date
@@ -114,6 +115,11 @@ class Task(Base):
     creator = relationship("User", back_populates="created_tasks", foreign_keys=[created_by])
     tag_usages = relationship("TaskTagUsage", back_populates="task")
     submissions = relationship("Submission", back_populates="task", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # 任务列表：status 过滤 + deadline 范围（进行中/已结束）+ created_at 倒序
+        Index("ix_tasks_status_deadline_created", "status", "deadline", "created_at"),
+    )
 
 
 class Submission(Base):
@@ -124,7 +130,7 @@ class Submission(Base):
     student_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     
     # Submission content
-    images = Column(JSON, nullable=False)  # JSON array of image URLs
+    images = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)  # JSON array of image URLs (PostgreSQL 下为 JSONB)
     photo_paths = Column(JSON, nullable=True)  # JSON array of local photo paths
     text = Column(Text, nullable=True)  # Optional text content
     submit_count = Column(Integer, default=1, nullable=False)  # 第几次提交 (max 3)
@@ -150,8 +156,20 @@ class Submission(Base):
     
     # Composite index for faster queries
     __table_args__ = (
-        # Ensure one student can only have one active submission per task
-        # (We'll handle multiple submissions in application logic)
+        # 同一学生同一任务可以有多条提交记录（每次提交一行），所以这里不加唯一约束
+        Index("ix_sub_student_task", "student_id", "task_id"),
+        # 同一学生同一任务的 submit_count 不能重复：并发提交算出同一个次数时，后插入的一方被拒绝
+        Index("uq_sub_task_student_count", "task_id", "student_id", "submit_count", unique=True),
+        # 待批改列表：status 过滤 + created_at 排序
+        Index("ix_sub_status_created", "status", "created_at"),
+        # 按任务筛选的待批改列表：status + task_id 过滤 + created_at 排序
+        Index("ix_sub_status_task_created", "status", "task_id", "created_at"),
+        # 我的提交：student_id 过滤 + created_at 倒序
+        Index("ix_sub_student_created", "student_id", "created_at"),
+        # 自动合并：task_id + student_id 过滤 + created_at 范围（最近 3 秒）
+        Index("ix_sub_task_student_created", "task_id", "student_id", "created_at"),
+        # 提交次数上限（每个学生每个任务最多 3 次）
+        CheckConstraint("submit_count BETWEEN 1 AND 3", name="ck_sub_submit_count_cap"),
         {"mysql_engine": "InnoDB"}
     )
 
@@ -3,8 +3,9 @@ from __future__ import annotations
 Pydantic models for request/response validation
 """
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import List, Optional, Any, Generic, TypeVar
+from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 
@@ -170,8 +171,37 @@ class SubmissionInfo(BaseModel):
     student_avatar: Optional[str] = None
     task_title: Optional[str] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+@dataclass
+class SubmissionRow:
+    """
+    提交列表接口的轻量 DTO，字段与 SubmissionInfo 一致。
+    列表路径不经过 Pydantic，由 orjson 直接序列化 dataclass（手写 __slots__ 以兼容 Python 3.9）。
+    """
+    __slots__ = (
+        "id", "task_id", "student_id", "images", "text", "submit_count", "status",
+        "score", "grade", "comment", "graded_by", "graded_at", "created_at",
+        "student_nickname", "student_avatar", "task_title",
+    )
+    
+    id: int
+    task_id: int
+    student_id: int
+    images: List[str]
+    text: Optional[str]
+    submit_count: int
+    status: str
+    score: Optional[float]
+    grade: Optional[str]
+    comment: Optional[str]
+    graded_by: Optional[int]
+    graded_at: Optional[datetime]
+    created_at: datetime
+    student_nickname: Optional[str]
+    student_avatar: Optional[str]
+    task_title: Optional[str]
 
 
 # Teacher management schemas
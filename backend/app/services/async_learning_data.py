@@ -3,13 +3,17 @@
 与现有异步API集成，处理打卡和积分逻辑
 """
 
+import logging
 from datetime import datetime, date, timedelta
 from typing import List, Dict, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import and_, or_, func, desc, select
 
+from app.database import AsyncSessionLocal
 from app.models import User, UserCheckin, UserScoreRecord, CheckinType, ScoreType, Submission, Grade
 
+logger = logging.getLogger(__name__)
+
 
 class AsyncLearningDataService:
     """异步学习数据统计服务类"""
@@ -249,4 +253,17 @@ async def trigger_grading_score_async(user_id: int, submission_id: int, task_id:
         submission_id=submission_id,
         task_id=task_id,
         grade=grade
-    )
\ No newline at end of file
+    )
+
+
+async def run_in_background_session(trigger, **kwargs):
+    """
+    在 BackgroundTasks 中执行上面的 trigger_*_async 便捷函数。
+    响应返回后请求的 db session 已关闭，这里单独开一个 session；
+    学习数据记录失败不应影响主业务流程，只记录日志。
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            await trigger(db=db, **kwargs)
+    except Exception as e:
+        logger.error("学习数据后台记录失败 (%s): %s", trigger.__name__, e)
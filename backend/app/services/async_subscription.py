@@ -10,6 +10,20 @@ from sqlalchemy import select, update
 from app.models import User, SubscriptionType, UserRole
 
 
+# 过期用户可访问的基础功能
+EXPIRED_FEATURES = frozenset({"basic_tasks", "basic_submissions"})
+
+# 试用用户的功能权限（未列出的功能默认可用）
+TRIAL_FEATURE_ACCESS = {
+    "leaderboard": True,           # 排行榜（所有用户可用）
+    "learning_data": True,         # 学习数据（所有用户可用）
+    "advanced_analytics": False,   # 高级分析（付费功能）
+    "export_data": False,          # 数据导出（付费功能）
+    "unlimited_submissions": False, # 无限提交（试用限制）
+    "premium_support": False       # 优先客服（付费功能）
+}
+
+
 class AsyncSubscriptionService:
     """异步订阅服务"""
     
@@ -73,17 +87,7 @@ class AsyncSubscriptionService:
             return ""
             
         status = await self.check_subscription_status(user)
-        
-        if status["is_premium"]:
-            return "付费用户"
-        elif status["is_trial"]:
-            days = status["days_remaining"]
-            if days > 0:
-                return f"试用用户 (剩余{days}天)"
-            else:
-                return "试用已过期"
-        else:
-            return "试用已过期"
+        return _display_text_from_status(status)
     
     async def upgrade_to_premium(self, user: User, days: int = 365) -> User:
         """升级为付费用户"""
@@ -95,6 +99,24 @@ class AsyncSubscriptionService:
         await self.db.refresh(user)
         return user
     
+    async def upgrade_and_describe(self, user: User, days: int = 365) -> Dict[str, Any]:
+        """
+        升级为付费用户并返回升级后的订阅状态和显示文本。
+        只有一次 UPDATE 提交；会话 expire_on_commit=False，提交后直接用内存中的字段计算，不再 refresh
+        """
+        user.subscription_type = SubscriptionType.PREMIUM
+        user.subscription_expires_at = datetime.utcnow() + timedelta(days=days)
+        user.is_active = True
+        
+        await self.db.commit()
+        
+        # 刚升级且未过期，check_subscription_status 不会再写库
+        status = await self.check_subscription_status(user)
+        return {
+            "subscription_status": status,
+            "display_text": _display_text_from_status(status)
+        }
+    
     async def has_feature_access(self, user: User, feature: str) -> bool:
         """检查用户是否有权限访问特定功能"""
         # Teachers always have premium access
@@ -105,19 +127,11 @@ class AsyncSubscriptionService:
         
         # 如果是过期用户，只能访问基础功能
         if status["is_expired"]:
-            return feature in ["basic_tasks", "basic_submissions"]
+            return feature in EXPIRED_FEATURES
         
         # 试用用户的限制
         if status["is_trial"]:
-            trial_limits = {
-                "leaderboard": True,           # 排行榜（所有用户可用）
-                "learning_data": True,         # 学习数据（所有用户可用）
-                "advanced_analytics": False,   # 高级分析（付费功能）
-                "export_data": False,          # 数据导出（付费功能）
-                "unlimited_submissions": False, # 无限提交（试用限制）
-                "premium_support": False       # 优先客服（付费功能）
-            }
-            return trial_limits.get(feature, True)
+            return TRIAL_FEATURE_ACCESS.get(feature, True)
         
         # 付费用户拥有所有功能
         if status["is_premium"]:
@@ -152,6 +166,20 @@ class AsyncSubscriptionService:
             }
 
 
+def _display_text_from_status(status: Dict[str, Any]) -> str:
+    """由订阅状态生成显示文本"""
+    if status["is_premium"]:
+        return "付费用户"
+    elif status["is_trial"]:
+        days = status["days_remaining"]
+        if days > 0:
+            return f"试用用户 (剩余{days}天)"
+        else:
+            return "试用已过期"
+    else:
+        return "试用已过期"
+
+
 # 便捷函数
 async def init_trial_user_async(user: User, db: AsyncSession) -> User:
     """初始化试用用户（便捷函数）"""
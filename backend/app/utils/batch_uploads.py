@@ -0,0 +1,187 @@
+"""
+Batch upload state
+分批上传的批次状态：启用 Redis 时存到 Redis（多 worker 共享，重启不丢），否则退回进程内字典。
+文件内容先写到暂存目录，这里只记录元数据和暂存文件路径。
+"""
+
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.utils.redis_client import get_redis
+from app.utils.storage_new import enhanced_storage
+
+logger = logging.getLogger(__name__)
+
+# 未启用 Redis 时的进程内批次状态（单 worker 部署使用）
+# 按最近更新排序，超过上限时淘汰最久未更新的批次，防止中途放弃的上传无限堆积
+LOCAL_BATCH_MAXSIZE = 256
+_local_batches: "OrderedDict[str, Dict]" = OrderedDict()
+
+# 过期批次清理间隔（秒）
+BATCH_JANITOR_INTERVAL = 60
+_janitor_task: Optional[asyncio.Task] = None
+
+
+def _batch_key(batch_id: str) -> str:
+    return f"upload:batch:{batch_id}"
+
+
+def _batch_files_key(batch_id: str) -> str:
+    return f"upload:batch:{batch_id}:files"
+
+
+async def add_batch_files(batch_id: str, task_id: int, student_id: int, text_content: str,
+                          total_files: int, staged_files: List[Dict]) -> Dict:
+    """
+    登记一次分批上传请求收到的文件，批次不存在时以本次请求的参数创建
+
+    Returns:
+        {'received_files': int, 'total_files': int}
+    """
+    redis = get_redis()
+    if redis is None:
+        # 从读取到更新批次状态之间不能有 await：并发到达的同一批次请求在事件循环上依次执行，
+        # 不会互相覆盖，也只会有一个请求看到批次凑齐
+        evicted = []
+        batch_info = _local_batches.get(batch_id)
+        if batch_info is None:
+            while len(_local_batches) >= LOCAL_BATCH_MAXSIZE:
+                evicted_id, _ = _local_batches.popitem(last=False)
+                evicted.append(evicted_id)
+            batch_info = _local_batches[batch_id] = {
+                'task_id': task_id,
+                'student_id': student_id,
+                'text_content': text_content,
+                'total_files': total_files,
+                'received_files': 0,
+                'files_data': [],
+                'created_at': datetime.utcnow()
+            }
+        _local_batches.move_to_end(batch_id)
+        batch_info['files_data'].extend(staged_files)
+        batch_info['received_files'] += 1
+        progress = {
+            'received_files': batch_info['received_files'],
+            'total_files': batch_info['total_files']
+        }
+
+        for evicted_id in evicted:
+            logger.warning(f"批次数量超过上限，丢弃最久未更新的批次: {evicted_id}")
+            await enhanced_storage.discard_staged_batch(evicted_id)
+        return progress
+
+    key = _batch_key(batch_id)
+    files_key = _batch_files_key(batch_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        # 只有第一个请求的参数生效，与原来的进程内实现一致
+        pipe.hsetnx(key, 'task_id', task_id)
+        pipe.hsetnx(key, 'student_id', student_id)
+        pipe.hsetnx(key, 'text_content', text_content)
+        pipe.hsetnx(key, 'total_files', total_files)
+        pipe.hsetnx(key, 'created_at', datetime.utcnow().isoformat())
+        if staged_files:
+            pipe.rpush(files_key, *[json.dumps(staged) for staged in staged_files])
+        pipe.expire(files_key, settings.UPLOAD_BATCH_TTL)
+        pipe.expire(key, settings.UPLOAD_BATCH_TTL)
+        pipe.hincrby(key, 'received_files', 1)
+        pipe.hget(key, 'total_files')
+        results = await pipe.execute()
+
+    return {
+        'received_files': int(results[-2]),
+        'total_files': int(results[-1])
+    }
+
+
+async def pop_batch(batch_id: str) -> Optional[Dict]:
+    """
+    取出并删除批次状态（只有一个请求能取到），批次不存在时返回 None
+
+    Returns:
+        {'task_id', 'student_id', 'text_content', 'total_files', 'received_files', 'files_data'}
+    """
+    redis = get_redis()
+    if redis is None:
+        return _local_batches.pop(batch_id, None)
+
+    key = _batch_key(batch_id)
+    files_key = _batch_files_key(batch_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hgetall(key)
+        pipe.lrange(files_key, 0, -1)
+        pipe.delete(key, files_key)
+        meta, files, _ = await pipe.execute()
+
+    if not meta:
+        return None
+
+    return {
+        'task_id': int(meta['task_id']),
+        'student_id': int(meta['student_id']),
+        'text_content': meta.get('text_content', ''),
+        'total_files': int(meta['total_files']),
+        'received_files': int(meta.get('received_files', 0)),
+        'files_data': [json.loads(staged) for staged in files]
+    }
+
+
+async def discard_batch(batch_id: str) -> None:
+    """删除批次状态（上传失败时调用），暂存文件由调用方清理"""
+    redis = get_redis()
+    if redis is None:
+        _local_batches.pop(batch_id, None)
+        return
+
+    await redis.delete(_batch_key(batch_id), _batch_files_key(batch_id))
+
+
+async def sweep_expired_batches() -> int:
+    """
+    清理过期批次：进程内状态按 created_at 过期；暂存目录按最后修改时间过期
+    （Redis 中的状态由 EXPIRE 自动删除，这里只需清理其暂存文件）
+
+    Returns:
+        删除的暂存目录数量
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.UPLOAD_BATCH_TTL)
+    expired = [
+        batch_id for batch_id, batch_info in _local_batches.items()
+        if batch_info['created_at'] < cutoff
+    ]
+    for batch_id in expired:
+        _local_batches.pop(batch_id, None)
+        await enhanced_storage.discard_staged_batch(batch_id)
+
+    removed = await enhanced_storage.cleanup_staged_batches(settings.UPLOAD_BATCH_TTL)
+    if expired or removed:
+        logger.info(f"清理过期上传批次: 状态 {len(expired)} 个, 暂存目录 {len(removed)} 个")
+    return len(removed)
+
+
+async def _run_batch_janitor():
+    while True:
+        try:
+            await sweep_expired_batches()
+        except Exception as e:
+            logger.error(f"清理过期上传批次失败: {str(e)}")
+        await asyncio.sleep(BATCH_JANITOR_INTERVAL)
+
+
+def start_batch_janitor():
+    """启动过期批次清理任务（应用启动时调用）"""
+    global _janitor_task
+    if _janitor_task is None:
+        _janitor_task = asyncio.create_task(_run_batch_janitor())
+
+
+def stop_batch_janitor():
+    """停止过期批次清理任务（应用关闭时调用）"""
+    global _janitor_task
+    if _janitor_task is not None:
+        _janitor_task.cancel()
+        _janitor_task = None
@@ -13,11 +13,17 @@ from sqlalchemy import select
 from app.config import settings
 from app.database import get_db
 from app.models import NotificationSettings
+from app.utils.redis_client import get_redis
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# 批改完成通知队列（Redis Stream），由独立的消费进程合并后调用微信接口发送
+GRADE_NOTIFY_STREAM = "wechat:grade-notify"
+GRADE_NOTIFY_STREAM_MAXLEN = 100000
+
+
 class NotificationService:
     """通知服务"""
     
@@ -175,6 +181,45 @@ class NotificationService:
         
         return await self.send_template_message(template_data)
     
+    async def enqueue_grade_notification(
+        self,
+        openid: str,
+        task_title: str,
+        grade: str,
+        score: Optional[float] = None,
+        comment: Optional[str] = None,
+        user_id: Optional[int] = None
+    ) -> bool:
+        """
+        将批改完成通知写入 Redis Stream，不在请求内调用微信接口
+        
+        Returns:
+            是否已入队；Redis 未启用或写入失败时返回 False
+        """
+        redis = get_redis()
+        if redis is None:
+            return False
+        
+        fields = {
+            "openid": openid,
+            "task_title": task_title,
+            "grade": grade,
+            "score": score,
+            "comment": comment,
+            "user_id": user_id
+        }
+        try:
+            await redis.xadd(
+                GRADE_NOTIFY_STREAM,
+                {key: value for key, value in fields.items() if value is not None},
+                maxlen=GRADE_NOTIFY_STREAM_MAXLEN,
+                approximate=True
+            )
+            return True
+        except Exception as e:
+            logger.error(f"批改通知入队失败: {str(e)}")
+            return False
+    
     async def send_deadline_reminder(
         self,
         openid: str,
@@ -0,0 +1,68 @@
+"""
+Cursor pagination helpers
+按 (created_at, id) 做游标分页的通用函数：游标是当前页最后一条的 (created_at, id)，
+下一页用 tuple_(created_at, id) 比较直接定位，不需要 OFFSET 扫描跳过的行。
+先按排序档位（rank，升序）再按 (created_at, id) 倒序的列表用带 rank 前缀的游标
+"""
+
+from datetime import datetime
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """游标 = 当前页最后一条的 (created_at, id)"""
+    return f"{created_at.isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, row_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+
+def page_with_cursor(rows: list, limit: int, key: Optional[Callable] = None) -> tuple:
+    """
+    查询时多取一条判断是否还有下一页；返回 (本页数据, next_cursor)
+    key: 从一行取出带 created_at/id 的对象（多实体查询的行用），默认就是行本身
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = key(rows[-1]) if key else rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
+
+
+def encode_ranked_cursor(rank: int, created_at: datetime, row_id: int) -> str:
+    """带排序档位的游标 = 当前页最后一条的 (rank, created_at, id)"""
+    return f"{rank}_{encode_cursor(created_at, row_id)}"
+
+
+def decode_ranked_cursor(cursor: str) -> tuple:
+    try:
+        rank, rest = cursor.split("_", 1)
+        rank = int(rank)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+    return (rank, *decode_cursor(rest))
+
+
+def page_with_ranked_cursor(rows: list, limit: int, rank: Callable, key: Optional[Callable] = None) -> tuple:
+    """
+    同 page_with_cursor，游标里多带一个排序档位
+    rank: 从一行取出排序档位
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = key(rows[-1]) if key else rows[-1]
+    return rows, encode_ranked_cursor(rank(rows[-1]), last.created_at, last.id)
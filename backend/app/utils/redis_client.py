@@ -0,0 +1,40 @@
+"""
+Redis client
+可选的 Redis 连接：CACHE_ENABLED=True 时按 REDIS_URL 懒加载，未启用时返回 None，调用方自行降级
+"""
+
+import logging
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_redis = None
+
+
+def get_redis():
+    """获取全局 Redis 客户端（redis.asyncio），未启用时返回 None"""
+    global _redis
+    
+    if not settings.CACHE_ENABLED:
+        return None
+    
+    if _redis is None:
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            logger.warning("未安装 redis 包，Redis 相关功能不可用")
+            return None
+        # from_url 不会立即建立连接，第一次执行命令时才连接
+        _redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    
+    return _redis
+
+
+async def close_redis():
+    """关闭连接池（应用关闭时调用）"""
+    global _redis
+    
+    if _redis is not None:
+        await _redis.close()
+        _redis = None
@@ -5,18 +5,80 @@ Enhanced file storage utilities with organized structure
 
 import os
 import re
+import shutil
+import tempfile
 import uuid
 # import oss2  # 暂时不使用OSS，使用本地存储
-from typing import BinaryIO, Optional, List, Dict
+from typing import BinaryIO, Optional, List, Dict, Union
 from datetime import datetime
+from starlette.concurrency import run_in_threadpool
 from app.config import settings
 
 
+# 流式上传时每次读取的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 暂存上传文件时的读块大小，以及留在内存里的上限（超过后落到临时文件）
+SPOOL_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
 class StorageError(Exception):
     """Storage operation error"""
     pass
 
 
+class FileTooLargeError(StorageError):
+    """File exceeds the allowed upload size"""
+    pass
+
+
+async def spool_upload(file, max_size: int, chunk_size: int = SPOOL_CHUNK_SIZE) -> tuple:
+    """
+    把上传流分块拷贝到 SpooledTemporaryFile，小文件留在内存，大文件落到临时文件
+    
+    Args:
+        file: 任何提供 ``async read(size)`` 的对象（如 FastAPI UploadFile）
+        max_size: 最大字节数，超过后立即中止
+        
+    Returns:
+        Tuple of (spool, size)，spool 已回到开头，由调用方负责 close()
+        
+    Raises:
+        FileTooLargeError: 文件超过 max_size
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    total = 0
+    try:
+        while chunk := await file.read(chunk_size):
+            total += len(chunk)
+            if total > max_size:
+                raise FileTooLargeError(f"File size exceeds {max_size} bytes")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, total
+
+
+def _write_local_file(local_path: str, file_content: Union[bytes, BinaryIO]) -> None:
+    """在线程池里执行的同步写盘：bytes 直接写，文件对象按块拷贝"""
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    with open(local_path, 'wb') as f:
+        if isinstance(file_content, (bytes, bytearray)):
+            f.write(file_content)
+        else:
+            file_content.seek(0)
+            shutil.copyfileobj(file_content, f, UPLOAD_CHUNK_SIZE)
+
+
+def _move_local_file(src_path: str, dst_path: str) -> None:
+    """在线程池里执行的同步移动：同一文件系统上只改目录项，不拷贝内容"""
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    shutil.move(src_path, dst_path)
+
+
 class EnhancedStorage:
     """增强的文件存储管理器，支持多文件类型和组织化结构"""
     
@@ -66,6 +128,9 @@ class EnhancedStorage:
         # 确保目录存在
         os.makedirs(self.local_dir, exist_ok=True)
         
+        # 分批上传的暂存目录（不对外提供静态访问）
+        self.staging_dir = settings.UPLOAD_STAGING_DIR
+        
         print(f"[STORAGE] ✅ 使用本地存储（优化版），目录: {os.path.abspath(self.local_dir)}")
     
     def _sanitize_filename(self, filename: str) -> str:
@@ -163,7 +228,7 @@ class EnhancedStorage:
         
         return folder_path, count
 
-    async def upload_submission_file(self, file_content: bytes, filename: str,
+    async def upload_submission_file(self, file_content: Union[bytes, BinaryIO], filename: str,
                                    task_id: int, student_id: int, 
                                    submission_time: datetime = None,
                                    content_type: str = None) -> str:
@@ -180,8 +245,8 @@ class EnhancedStorage:
             if not submission_time:
                 submission_time = datetime.now()
             
-            # Check file size (10MB limit)
-            if len(file_content) > 10 * 1024 * 1024:
+            # Check file size (10MB limit)；文件对象在暂存时已经检查过大小
+            if isinstance(file_content, (bytes, bytearray)) and len(file_content) > 10 * 1024 * 1024:
                 raise StorageError(f"File size exceeds 10MB limit")
             
             # Get file type info
@@ -217,11 +282,9 @@ class EnhancedStorage:
             
             # ===== 新代码：强制本地存储 =====
             local_path = os.path.join(self.local_dir, object_name)
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
             
-            # 写入文件
-            with open(local_path, 'wb') as f:
-                f.write(file_content)
+            # 写入文件（放到线程池，避免大文件拷贝阻塞事件循环）
+            await run_in_threadpool(_write_local_file, local_path, file_content)
             
             # Return a local URL
             return f"/uploads/{object_name}"
@@ -229,13 +292,54 @@ class EnhancedStorage:
         except Exception as e:
             raise StorageError(f"Failed to upload file: {str(e)}")
 
+    async def upload_image_stream(self, file, filename: str, max_size: int,
+                                  chunk_size: int = UPLOAD_CHUNK_SIZE) -> tuple:
+        """
+        Stream an image to storage chunk by chunk (单图上传，不把整个文件读进内存)
+        
+        Args:
+            file: 任何提供 ``async read(size)`` 的对象（如 FastAPI UploadFile）
+            filename: 原始文件名，只用来取扩展名
+            max_size: 最大字节数，超过后立即中止并删除已写入的部分
+            
+        Returns:
+            Tuple of (url, size)
+            
+        Raises:
+            FileTooLargeError: 文件超过 max_size
+            StorageError: 其他写入失败
+        """
+        ext = filename.split('.')[-1] if filename and '.' in filename else 'jpg'
+        date_path = datetime.now().strftime("%Y%m%d")
+        object_name = f"submissions/{date_path}/{uuid.uuid4().hex}.{self._sanitize_filename(ext)}"
+        local_path = os.path.join(self.local_dir, object_name)
+        
+        total = 0
+        try:
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'wb') as f:
+                while chunk := await file.read(chunk_size):
+                    total += len(chunk)
+                    if total > max_size:
+                        raise FileTooLargeError(f"File size exceeds {max_size} bytes")
+                    f.write(chunk)
+        except Exception as e:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            if isinstance(e, StorageError):
+                raise
+            raise StorageError(f"Failed to upload file: {str(e)}")
+        
+        return f"/uploads/{object_name}", total
+
     async def upload_files_to_submission(self, files_data: List[Dict], task_id: int, 
                                        student_id: int, submission_time: datetime = None) -> Dict:
         """
         Upload multiple files to a submission folder (优化版：并行上传)
         
         Args:
-            files_data: List of {'content': bytes, 'filename': str, 'content_type': str}
+            files_data: List of {'content': bytes 或文件对象, 'filename': str,
+                        'content_type': str, 'size': int（content 为文件对象时必填）}
             task_id: Task ID
             student_id: Student ID
             submission_time: Submission timestamp
@@ -331,7 +435,7 @@ class EnhancedStorage:
                 uploaded_files.append({
                     'filename': filename,
                     'url': result,
-                    'size': len(file_data['content']),
+                    'size': file_data['size'] if 'size' in file_data else len(file_data['content']),
                     'file_type': self._get_file_type_info(filename)[0]
                 })
                 print(f"[STORAGE] ✅ 文件上传成功: {filename}")
@@ -347,6 +451,110 @@ class EnhancedStorage:
             'submission_time': submission_time.isoformat()
         }
 
+    def _batch_staging_dir(self, batch_id: str) -> str:
+        return os.path.join(self.staging_dir, 'batch', self._sanitize_filename(batch_id))
+
+    async def stage_batch_file(self, batch_id: str, index: int, file_data: Dict) -> Dict:
+        """
+        Write one file of a batch upload to the staging directory
+        批次凑齐前文件只落在暂存目录，进程内存和批次状态里只保留路径
+        
+        Args:
+            file_data: {'content': bytes 或文件对象, 'size': int, 'filename': str, 'content_type': str}
+            
+        Returns:
+            {'path', 'size', 'filename', 'content_type', 'index'}
+        """
+        staged_path = os.path.join(
+            self._batch_staging_dir(batch_id), f"{index}_{uuid.uuid4().hex}"
+        )
+        try:
+            await run_in_threadpool(_write_local_file, staged_path, file_data['content'])
+        except Exception as e:
+            raise StorageError(f"Failed to stage file: {str(e)}")
+        
+        return {
+            'path': staged_path,
+            'size': file_data['size'],
+            'filename': file_data['filename'],
+            'content_type': file_data.get('content_type'),
+            'index': index
+        }
+
+    async def commit_staged_files(self, staged_files: List[Dict], task_id: int,
+                                  student_id: int, submission_time: datetime = None) -> Dict:
+        """
+        Move staged batch files into the submission folder
+        返回结构与 upload_files_to_submission 相同
+        """
+        import asyncio
+        
+        if not submission_time:
+            submission_time = datetime.now()
+        
+        folder_path, submission_count = await self.create_submission_folder(
+            task_id, student_id, submission_time
+        )
+        
+        object_names = [
+            self._generate_submission_path(task_id, student_id, submission_time, staged['filename'])
+            for staged in staged_files
+        ]
+        move_results = await asyncio.gather(
+            *[
+                run_in_threadpool(_move_local_file, staged['path'], os.path.join(self.local_dir, object_name))
+                for staged, object_name in zip(staged_files, object_names)
+            ],
+            return_exceptions=True
+        )
+        
+        uploaded_files = []
+        failed_files = []
+        for staged, object_name, result in zip(staged_files, object_names, move_results):
+            if isinstance(result, Exception):
+                failed_files.append({
+                    'filename': staged['filename'],
+                    'error': str(result)
+                })
+                print(f"[STORAGE] ❌ 暂存文件转存失败: {staged['filename']}, 错误: {result}")
+            else:
+                uploaded_files.append({
+                    'filename': staged['filename'],
+                    'url': f"/uploads/{object_name}",
+                    'size': staged['size'],
+                    'file_type': self._get_file_type_info(staged['filename'])[0]
+                })
+        
+        return {
+            'submission_count': submission_count,
+            'folder_path': folder_path,
+            'uploaded_files': uploaded_files,
+            'failed_files': failed_files,
+            'success': len(failed_files) == 0,
+            'submission_time': submission_time.isoformat()
+        }
+
+    async def discard_staged_batch(self, batch_id: str) -> None:
+        """删除批次暂存目录（批次完成、失败或过期后调用）"""
+        await run_in_threadpool(shutil.rmtree, self._batch_staging_dir(batch_id), True)
+
+    def _remove_stale_staging_dirs(self, max_age: int) -> List[str]:
+        batch_root = os.path.join(self.staging_dir, 'batch')
+        if not os.path.isdir(batch_root):
+            return []
+        
+        cutoff = datetime.now().timestamp() - max_age
+        removed = []
+        for entry in os.scandir(batch_root):
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed.append(entry.name)
+        return removed
+
+    async def cleanup_staged_batches(self, max_age: int) -> List[str]:
+        """删除超过 max_age 秒未更新的批次暂存目录（客户端中途放弃的批次），返回被删除的目录名"""
+        return await run_in_threadpool(self._remove_stale_staging_dirs, max_age)
+
     async def delete_file(self, file_url: str) -> bool:
         """Delete file from storage"""
         try:
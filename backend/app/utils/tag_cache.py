@@ -0,0 +1,60 @@
+"""
+Tag hierarchy cache
+标签层级接口的响应缓存：启用 Redis 时存到 Redis（多 worker 共享），否则退回进程内 TTL 缓存。
+缓存的是序列化好的 JSON 响应体，命中时直接返回，不再查库和构建树；标签增删改后调用 invalidate_tag_hierarchy。
+"""
+
+import logging
+from typing import Optional
+
+from cachetools import TTLCache
+
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+TAG_HIERARCHY_KEY = "tags:hierarchy:v1"
+TAG_HIERARCHY_TTL = 300
+
+# 未启用 Redis 时的进程内缓存；多 worker 时其他进程最多 ttl 秒内可能读到旧数据
+_local_cache: TTLCache = TTLCache(maxsize=1, ttl=60)
+
+
+async def get_cached_tag_hierarchy() -> Optional[str]:
+    """读取缓存的层级响应体，未命中或 Redis 出错时返回 None"""
+    redis = get_redis()
+    if redis is None:
+        return _local_cache.get(TAG_HIERARCHY_KEY)
+
+    try:
+        return await redis.get(TAG_HIERARCHY_KEY)
+    except Exception as e:
+        logger.warning(f"读取标签层级缓存失败: {str(e)}")
+        return None
+
+
+async def set_cached_tag_hierarchy(body: str) -> None:
+    """写入层级响应体缓存"""
+    redis = get_redis()
+    if redis is None:
+        _local_cache[TAG_HIERARCHY_KEY] = body
+        return
+
+    try:
+        await redis.setex(TAG_HIERARCHY_KEY, TAG_HIERARCHY_TTL, body)
+    except Exception as e:
+        logger.warning(f"写入标签层级缓存失败: {str(e)}")
+
+
+async def invalidate_tag_hierarchy() -> None:
+    """标签创建、修改、删除后清除层级缓存"""
+    _local_cache.pop(TAG_HIERARCHY_KEY, None)
+
+    redis = get_redis()
+    if redis is None:
+        return
+
+    try:
+        await redis.delete(TAG_HIERARCHY_KEY)
+    except Exception as e:
+        logger.warning(f"清除标签层级缓存失败: {str(e)}")
@@ -0,0 +1,58 @@
+"""
+Task title cache
+任务标题的进程内 TTL 缓存，列表接口展示任务标题时优先命中缓存，减少对 tasks 表的重复查询
+"""
+
+from typing import Dict, Iterable, Optional
+
+from cachetools import TTLCache
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Task
+
+# 多 worker 时每个进程各有一份，修改标题后其他进程最多 ttl 秒内可能读到旧标题
+_task_title_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+
+async def get_task_titles(db: AsyncSession, task_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    批量获取任务标题，未命中的 id 用一条 IN 查询补齐（只查 id 和 title 两列）
+    """
+    titles: Dict[int, str] = {}
+    missing = []
+    for task_id in set(task_ids):
+        title = _task_title_cache.get(task_id)
+        if title is not None:
+            titles[task_id] = title
+        else:
+            missing.append(task_id)
+
+    if missing:
+        result = await db.execute(
+            select(Task.id, Task.title).where(Task.id.in_(missing))
+        )
+        for task_id, title in result.all():
+            _task_title_cache[task_id] = title
+            titles[task_id] = title
+
+    return titles
+
+
+async def get_task_title(db: AsyncSession, task_id: int) -> Optional[str]:
+    """获取单个任务标题"""
+    titles = await get_task_titles(db, [task_id])
+    return titles.get(task_id)
+
+
+async def task_exists(db: AsyncSession, task_id: int) -> bool:
+    """
+    任务是否存在（上传接口的存在性校验），命中标题缓存时不查库；
+    缓存只记录存在的任务，删除任务时由 invalidate_task_title 清除
+    """
+    return await get_task_title(db, task_id) is not None
+
+
+def invalidate_task_title(task_id: int) -> None:
+    """任务标题修改或任务删除后清除缓存"""
+    _task_title_cache.pop(task_id, None)
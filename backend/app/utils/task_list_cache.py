@@ -0,0 +1,121 @@
+"""
+Task list cache
+任务列表和任务统计接口的响应缓存：启用 Redis 时存到 Redis（多 worker 共享），否则退回进程内 TTL 缓存。
+缓存键里带两个版本号：任务增删改时递增全局版本，某个学生的提交变化时递增该学生的版本，
+旧版本的缓存不再被读到、等 TTL 自然过期，失效时不需要扫描或逐个删除键。
+截止时间到点引起的状态变化不触发失效，最多延迟 TASK_LIST_TTL 秒。
+"""
+
+import logging
+from typing import Dict, Optional
+
+from cachetools import TTLCache
+
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+TASK_LIST_TTL = 30
+# 学生版本号闲置一天后过期，过期重置时对应的旧缓存早已过期
+USER_VERSION_TTL = 86400
+
+TASK_LIST_VERSION_KEY = "tasks:list:ver"
+
+# 未启用 Redis 时的进程内缓存和版本号；多 worker 时其他进程最多 ttl 秒内可能读到旧数据
+_local_cache: TTLCache = TTLCache(maxsize=1024, ttl=TASK_LIST_TTL)
+_local_versions: Dict[str, int] = {}
+
+
+def _user_version_key(user_id: int) -> str:
+    return f"tasks:list:user:{user_id}:ver"
+
+
+async def build_task_cache_key(user_id: int, *parts) -> Optional[str]:
+    """
+    按当前版本号生成缓存键；同一个键先用于读缓存，未命中时再用于写缓存，
+    这样查询期间发生的写操作会让本次结果写到旧版本下，不会被后续请求读到。
+    Redis 出错时返回 None（本次不走缓存）
+    """
+    user_key = _user_version_key(user_id)
+    redis = get_redis()
+    if redis is None:
+        versions = (_local_versions.get(TASK_LIST_VERSION_KEY, 0), _local_versions.get(user_key, 0))
+    else:
+        try:
+            versions = await redis.mget(TASK_LIST_VERSION_KEY, user_key)
+        except Exception as e:
+            logger.warning(f"读取任务列表缓存版本失败: {str(e)}")
+            return None
+
+    task_version, user_version = (int(version or 0) for version in versions)
+    suffix = ":".join(str(part) for part in parts)
+    return f"tasks:list:v{task_version}:u{user_id}:v{user_version}:{suffix}"
+
+
+async def get_cached_task_response(key: Optional[str]) -> Optional[str]:
+    """读取缓存的响应体，未命中或 Redis 出错时返回 None"""
+    if key is None:
+        return None
+
+    redis = get_redis()
+    if redis is None:
+        return _local_cache.get(key)
+
+    try:
+        return await redis.get(key)
+    except Exception as e:
+        logger.warning(f"读取任务列表缓存失败: {str(e)}")
+        return None
+
+
+async def set_cached_task_response(key: Optional[str], body: str) -> None:
+    """写入响应体缓存"""
+    if key is None:
+        return
+
+    redis = get_redis()
+    if redis is None:
+        _local_cache[key] = body
+        return
+
+    try:
+        await redis.setex(key, TASK_LIST_TTL, body)
+    except Exception as e:
+        logger.warning(f"写入任务列表缓存失败: {str(e)}")
+
+
+async def invalidate_task_lists() -> None:
+    """任务创建、修改、删除、切换状态后使所有用户的任务列表缓存失效"""
+    redis = get_redis()
+    if redis is None:
+        _local_versions[TASK_LIST_VERSION_KEY] = _local_versions.get(TASK_LIST_VERSION_KEY, 0) + 1
+        _local_cache.clear()
+        return
+
+    try:
+        await redis.incr(TASK_LIST_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"清除任务列表缓存失败: {str(e)}")
+
+
+async def invalidate_user_task_lists(user_id: int) -> None:
+    """学生的提交新增、批改、合并后使该学生的任务列表和统计缓存失效"""
+    user_key = _user_version_key(user_id)
+    redis = get_redis()
+    if redis is None:
+        _local_versions[user_key] = _local_versions.get(user_key, 0) + 1
+        return
+
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.incr(user_key)
+            pipe.expire(user_key, USER_VERSION_TTL)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"清除任务列表缓存失败: {str(e)}")
+
+
+def clear_local() -> None:
+    """清空进程内缓存和版本号（未启用 Redis 时使用的那一份）"""
+    _local_cache.clear()
+    _local_versions.clear()
@@ -3,52 +3,51 @@
 根据PRD要求计算前端显示状态
 """
 
-from datetime import datetime
-from typing import Dict, Optional
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
 from app.models import Task, Submission, TaskType, TaskStatus, SubmissionStatus, Grade
 
 
-def calculate_display_status(task: Task, submission: Optional[Submission] = None) -> Dict[str, str]:
+# Use Chinese time (UTC+8) as standard time for the app
+CHINA_TZ = timezone(timedelta(hours=8))
+
+
+def china_now() -> datetime:
+    """当前北京时间（naive，与数据库中的时间直接比较）"""
+    return datetime.now(CHINA_TZ).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=4096)
+def _display_status_for(
+    task_type: Optional[TaskType],
+    task_status: TaskStatus,
+    past_deadline: bool,
+    submission_status: Optional[SubmissionStatus],
+    submission_grade: Optional[Grade]
+) -> Tuple[str, str, str]:
     """
-    Calculate display status for frontend according to PRD requirements
-    
-    返回前端需要的状态显示：
-    - right_status: 右上角显示（待提交/待批改/评价档位）
-    - left_status: 左下角显示（正在进行中/课后加餐/已结束/已完成）
-    - card_style: 卡片样式（normal/ended/completed）
-    
-    Args:
-        task: 任务对象
-        submission: 用户提交记录（可选）
-    
-    Returns:
-        包含显示状态的字典
+    展示状态只取决于这几个取值（截止时间已折算成是否已过期），结果可以跨任务、跨请求复用。
+    submission_status 为 None 表示没有提交记录
     """
-    # Use Chinese time (UTC+8) as standard time for the app
-    from datetime import timezone, timedelta
-    china_tz = timezone(timedelta(hours=8))
-    now_china = datetime.now(china_tz)
-    # Convert to naive datetime for comparison with database
-    now = now_china.replace(tzinfo=None)
-    
     # 计算右上角状态
-    if not submission:
+    if submission_status is None:
         right_status = "待提交"
-    elif submission.status == SubmissionStatus.SUBMITTED:
+    elif submission_status == SubmissionStatus.SUBMITTED:
         right_status = "待批改"
     else:  # SubmissionStatus.GRADED
-        right_status = submission.grade.value if submission.grade else "已批改"
+        right_status = submission_grade.value if submission_grade else "已批改"
     
     # 计算左下角状态
-    if task.task_type == TaskType.EXTRA:
+    if task_type == TaskType.EXTRA:
         left_status = "课后加餐"
-    elif task.status == TaskStatus.ONGOING:
-        if task.deadline and now > task.deadline:
+    elif task_status == TaskStatus.ONGOING:
+        if past_deadline:
             left_status = "已结束"
         else:
             left_status = "正在进行中"
-    elif task.status == TaskStatus.ENDED:
-        if submission and submission.status == SubmissionStatus.GRADED:
+    elif task_status == TaskStatus.ENDED:
+        if submission_status == SubmissionStatus.GRADED:
             left_status = "已完成"
         else:
             left_status = "已结束"
@@ -63,6 +62,39 @@ def calculate_display_status(task: Task, submission: Optional[Submission] = None
     else:
         card_style = "normal"
     
+    return right_status, left_status, card_style
+
+
+def calculate_display_status(task: Task, submission: Optional[Submission] = None,
+                             now: Optional[datetime] = None) -> Dict[str, str]:
+    """
+    Calculate display status for frontend according to PRD requirements
+    
+    返回前端需要的状态显示：
+    - right_status: 右上角显示（待提交/待批改/评价档位）
+    - left_status: 左下角显示（正在进行中/课后加餐/已结束/已完成）
+    - card_style: 卡片样式（normal/ended/completed）
+    
+    Args:
+        task: 任务对象
+        submission: 用户提交记录（可选）
+        now: 当前北京时间（可选，列表接口传入同一个值，避免逐行取时间）
+    
+    Returns:
+        包含显示状态的字典
+    """
+    if now is None:
+        now = china_now()
+    past_deadline = bool(task.deadline and now > task.deadline)
+    
+    right_status, left_status, card_style = _display_status_for(
+        task.task_type,
+        task.status,
+        past_deadline,
+        submission.status if submission else None,
+        submission.grade if submission else None
+    )
+    
     return {
         "right_status": right_status,
         "left_status": left_status,
@@ -86,6 +118,35 @@ def should_pin_task(task: Task) -> bool:
     return task.task_type == TaskType.EXTRA
 
 
+@lru_cache(maxsize=1024)
+def _priority_for(
+    task_type: Optional[TaskType],
+    task_status: TaskStatus,
+    submission_status: Optional[SubmissionStatus]
+) -> int:
+    """优先级只取决于任务类型、任务状态和提交状态，结果可以复用"""
+    # 课后加餐任务且未完成 - 最高优先级
+    if (task_type == TaskType.EXTRA and 
+        submission_status != SubmissionStatus.GRADED):
+        return 1
+    
+    # 正在进行中的任务
+    if task_status == TaskStatus.ONGOING:
+        return 2
+    
+    # 已结束但未批改
+    if (task_status == TaskStatus.ENDED and 
+        submission_status == SubmissionStatus.SUBMITTED):
+        return 3
+    
+    # 已完成的任务
+    if submission_status == SubmissionStatus.GRADED:
+        return 4
+    
+    # 其他情况
+    return 5
+
+
 def get_task_priority(task: Task, submission: Optional[Submission] = None) -> int:
     """
     获取任务显示优先级，用于排序
@@ -103,23 +164,8 @@ def get_task_priority(task: Task, submission: Optional[Submission] = None) -> in
     Returns:
         优先级数值，数值越小优先级越高
     """
-    # 课后加餐任务且未完成 - 最高优先级
-    if (task.task_type == TaskType.EXTRA and 
-        (not submission or submission.status != SubmissionStatus.GRADED)):
-        return 1
-    
-    # 正在进行中的任务
-    if task.status == TaskStatus.ONGOING:
-        return 2
-    
-    # 已结束但未批改
-    if (task.status == TaskStatus.ENDED and 
-        submission and submission.status == SubmissionStatus.SUBMITTED):
-        return 3
-    
-    # 已完成的任务
-    if (submission and submission.status == SubmissionStatus.GRADED):
-        return 4
-    
-    # 其他情况
-    return 5
\ No newline at end of file
+    return _priority_for(
+        task.task_type,
+        task.status,
+        submission.status if submission else None
+    )
@@ -0,0 +1,23 @@
+"""
+集成测试共用的数据库夹具：每个测试一个独立的内存 SQLite 库
+"""
+
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+
+
+@pytest_asyncio.fixture
+async def session_factory():
+    # StaticPool：所有会话共用同一个连接，才能看到同一个内存库
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
@@ -0,0 +1,80 @@
+"""
+提交次数上限集成测试
+====================
+
+测试覆盖范围:
+- _insert_submission 在同一条 INSERT 里分配 submit_count，满 3 次后不再插入
+- 两条记录写入相同 submit_count 时由唯一索引拒绝（并发提交的兜底）
+- 非提交次数约束的 IntegrityError 不会被当成"已达上限"
+"""
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.models import Submission, Task, User
+from app.api.submissions import _MAX_SUBMISSIONS, _insert_submission, _is_submit_count_conflict
+
+
+async def _create_student_and_task(factory) -> tuple:
+    async with factory() as db:
+        student = User(openid="student-openid", nickname="学生")
+        db.add(student)
+        await db.flush()
+        task = Task(title="申论练习", course="申论", desc="作业", created_by=student.id)
+        db.add(task)
+        await db.commit()
+        return student.id, task.id
+
+
+async def _submit_counts(factory, task_id: int, student_id: int) -> list:
+    async with factory() as db:
+        result = await db.execute(
+            select(Submission.submit_count)
+            .where(Submission.task_id == task_id, Submission.student_id == student_id)
+            .order_by(Submission.submit_count)
+        )
+        return list(result.scalars())
+
+
+@pytest.mark.asyncio
+async def test_fourth_submission_is_rejected(session_factory):
+    student_id, task_id = await _create_student_and_task(session_factory)
+
+    created = []
+    for i in range(_MAX_SUBMISSIONS + 1):
+        async with session_factory() as db:
+            created.append(await _insert_submission(db, task_id, student_id, [f"img{i}.jpg"], None))
+
+    assert [row.submit_count for row in created[:_MAX_SUBMISSIONS]] == [1, 2, 3]
+    assert created[_MAX_SUBMISSIONS] is None
+    assert await _submit_counts(session_factory, task_id, student_id) == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_duplicate_submit_count_is_rejected(session_factory):
+    student_id, task_id = await _create_student_and_task(session_factory)
+
+    async with session_factory() as db:
+        await _insert_submission(db, task_id, student_id, ["img.jpg"], None)
+
+    # 模拟并发请求按同一个最大值算出了相同的 submit_count
+    async with session_factory() as db:
+        db.add(Submission(task_id=task_id, student_id=student_id, images=[], submit_count=1))
+        with pytest.raises(IntegrityError) as exc_info:
+            await db.commit()
+
+    assert _is_submit_count_conflict(exc_info.value)
+    assert await _submit_counts(session_factory, task_id, student_id) == [1]
+
+
+@pytest.mark.asyncio
+async def test_other_integrity_errors_are_raised(session_factory):
+    student_id, task_id = await _create_student_and_task(session_factory)
+
+    async with session_factory() as db:
+        # task_id 是 NOT NULL 列，失败原因与提交次数无关，应当原样抛出
+        with pytest.raises(IntegrityError) as exc_info:
+            await _insert_submission(db, None, student_id, ["img.jpg"], None)
+
+    assert not _is_submit_count_conflict(exc_info.value)
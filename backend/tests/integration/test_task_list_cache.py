@@ -0,0 +1,94 @@
+"""
+任务列表缓存失效集成测试
+========================
+
+测试覆盖范围:
+- 任务写操作递增全局版本号，下一次读取换了缓存键、不命中旧缓存
+- 学生提交递增该学生的版本号，只影响该学生的缓存键
+"""
+
+import orjson
+import pytest
+
+from app.models import Task, TaskStatus, User, UserRole
+from app.api.tasks import list_tasks
+from app.api.submissions import _insert_submission
+from app.utils.task_list_cache import (
+    build_task_cache_key, clear_local, get_cached_task_response, invalidate_task_lists
+)
+
+
+@pytest.fixture(autouse=True)
+def _reset_task_list_cache():
+    # 未启用 Redis 时走进程内缓存，每个测试从空缓存开始
+    clear_local()
+
+
+async def _seed(factory) -> tuple:
+    async with factory() as db:
+        teacher = User(openid="teacher-openid", nickname="老师", role=UserRole.TEACHER)
+        student = User(openid="student-openid", nickname="学生", role=UserRole.STUDENT)
+        other = User(openid="other-openid", nickname="同学", role=UserRole.STUDENT)
+        db.add_all([teacher, student, other])
+        await db.flush()
+        task = Task(title="申论练习", course="申论", desc="作业", status=TaskStatus.ONGOING, created_by=teacher.id)
+        db.add(task)
+        await db.commit()
+        return teacher, student, other, task
+
+
+async def _list(factory, user: User) -> dict:
+    async with factory() as db:
+        response = await list_tasks(
+            status=None, page=1, page_size=20, keyword="", cursor=None,
+            current_user=user, db=db
+        )
+    return orjson.loads(response.body)["data"]
+
+
+async def _list_cache_key(user: User):
+    # 与 list_tasks 使用相同的键参数
+    return await build_task_cache_key(user.id, "list", None, 1, 20, "", None)
+
+
+@pytest.mark.asyncio
+async def test_task_write_invalidates_list_cache(session_factory):
+    teacher, student, _, _ = await _seed(session_factory)
+
+    first = await _list(session_factory, student)
+    old_key = await _list_cache_key(student)
+    assert await get_cached_task_response(old_key) is not None
+
+    async with session_factory() as db:
+        db.add(Task(title="新任务", course="申论", desc="作业", status=TaskStatus.ONGOING, created_by=teacher.id))
+        await db.commit()
+    await invalidate_task_lists()
+
+    new_key = await _list_cache_key(student)
+    assert new_key != old_key
+    assert await get_cached_task_response(new_key) is None
+
+    second = await _list(session_factory, student)
+    assert second["total"] == first["total"] + 1
+
+
+@pytest.mark.asyncio
+async def test_submission_invalidates_only_that_students_cache(session_factory):
+    _, student, other, task = await _seed(session_factory)
+
+    await _list(session_factory, student)
+    await _list(session_factory, other)
+    student_key = await _list_cache_key(student)
+    other_key = await _list_cache_key(other)
+
+    async with session_factory() as db:
+        assert await _insert_submission(db, task.id, student.id, ["img.jpg"], None) is not None
+
+    new_student_key = await _list_cache_key(student)
+    assert new_student_key != student_key
+    assert await get_cached_task_response(new_student_key) is None
+    assert await _list_cache_key(other) == other_key
+    assert await get_cached_task_response(other_key) is not None
+
+    refreshed = await _list(session_factory, student)
+    assert refreshed["tasks"][0]["submission_status"] == "submitted"
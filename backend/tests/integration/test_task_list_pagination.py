@@ -0,0 +1,111 @@
+"""
+任务列表游标分页集成测试
+========================
+
+测试覆盖范围:
+- cursor 翻页按 (优先级, created_at, id) 定位，逐页拼接的结果与一次取全量的顺序一致
+- 跨优先级档位、created_at 相同的任务在页边界上不重复、不遗漏
+- 最后一页不再返回 next_cursor
+"""
+
+from datetime import datetime
+
+import orjson
+import pytest
+
+from app.models import Submission, SubmissionStatus, Task, TaskStatus, TaskType, User, UserRole
+from app.api.tasks import list_tasks
+from app.utils.task_list_cache import clear_local
+
+
+@pytest.fixture(autouse=True)
+def _reset_task_list_cache():
+    # 列表响应有进程内缓存，每个测试从空缓存开始
+    clear_local()
+
+
+async def _seed_tasks(factory) -> User:
+    """
+    建一个学生和覆盖全部 5 个优先级档位的任务；
+    部分任务 created_at 相同，只能靠 id 区分先后
+    """
+    same_time = datetime(2026, 9, 1, 8, 0, 0)
+    async with factory() as db:
+        teacher = User(openid="teacher-openid", nickname="老师", role=UserRole.TEACHER)
+        student = User(openid="student-openid", nickname="学生", role=UserRole.STUDENT)
+        db.add_all([teacher, student])
+        await db.flush()
+
+        def make_task(title, status, task_type=TaskType.LIVE, created_at=same_time):
+            return Task(
+                title=title, course="申论", desc="作业", status=status,
+                task_type=task_type, created_by=teacher.id, created_at=created_at
+            )
+
+        tasks = [
+            make_task("加餐1", TaskStatus.ONGOING, TaskType.EXTRA),
+            make_task("加餐2", TaskStatus.ONGOING, TaskType.EXTRA, datetime(2026, 9, 2)),
+            make_task("进行中1", TaskStatus.ONGOING),
+            make_task("进行中2", TaskStatus.ONGOING),
+            make_task("进行中3", TaskStatus.ONGOING, created_at=datetime(2026, 8, 30)),
+            make_task("待批改", TaskStatus.ENDED),
+            make_task("已批改", TaskStatus.ENDED),
+            make_task("已结束1", TaskStatus.ENDED),
+            make_task("已结束2", TaskStatus.ENDED),
+        ]
+        db.add_all(tasks)
+        await db.flush()
+
+        db.add_all([
+            Submission(task_id=tasks[5].id, student_id=student.id, images=[], submit_count=1,
+                       status=SubmissionStatus.SUBMITTED),
+            Submission(task_id=tasks[6].id, student_id=student.id, images=[], submit_count=1,
+                       status=SubmissionStatus.GRADED),
+        ])
+        await db.commit()
+        return student
+
+
+async def _list(factory, student: User, page_size: int, cursor=None, page: int = 1) -> dict:
+    async with factory() as db:
+        response = await list_tasks(
+            status=None, page=page, page_size=page_size, keyword="", cursor=cursor,
+            current_user=student, db=db
+        )
+    return orjson.loads(response.body)["data"]
+
+
+@pytest.mark.asyncio
+async def test_cursor_pages_match_full_listing(session_factory):
+    student = await _seed_tasks(session_factory)
+
+    full = await _list(session_factory, student, page_size=100)
+    expected_ids = [task["id"] for task in full["tasks"]]
+    assert len(expected_ids) == 9
+    assert full["next_cursor"] is None
+    # 全量结果本身按优先级升序
+    priorities = [task["sort_priority"] for task in full["tasks"]]
+    assert priorities == sorted(priorities)
+
+    seen_ids = []
+    cursor = None
+    for _ in range(10):
+        page = await _list(session_factory, student, page_size=2, cursor=cursor)
+        seen_ids.extend(task["id"] for task in page["tasks"])
+        assert page["total"] == 9
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen_ids == expected_ids
+
+
+@pytest.mark.asyncio
+async def test_first_cursor_page_matches_offset_page(session_factory):
+    student = await _seed_tasks(session_factory)
+
+    first = await _list(session_factory, student, page_size=4)
+    second_by_cursor = await _list(session_factory, student, page_size=4, cursor=first["next_cursor"])
+    second_by_offset = await _list(session_factory, student, page_size=4, page=2)
+
+    assert [task["id"] for task in second_by_cursor["tasks"]] == [task["id"] for task in second_by_offset["tasks"]]